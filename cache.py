@@ -0,0 +1,237 @@
+"""
+Módulo de caché en memoria para las lecturas más frecuentes de los modelos.
+
+Cada método cacheado tiene su propia caché con un tiempo de vida (TTL) y un
+número máximo de entradas; al superarlo se descarta la entrada usada hace más
+tiempo (LRU). Las escrituras de los modelos invalidan explícitamente las cachés
+afectadas y cada caché lleva la cuenta de aciertos y fallos.
+
+Con varios procesos (p. ej. workers de gunicorn) la invalidación explícita solo
+alcanza al proceso que escribe. Por eso cada caché declara de qué tablas depende
+y, en cada petición, sincronizar_versiones() compara la versión de esas tablas en
+la base de datos con la última vista y descarta las cachés obsoletas.
+
+"""
+
+import functools
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Número máximo de entradas por caché si el método no indica otro
+CACHE_MAX_ENTRADAS = int(os.environ.get('STORE_CACHE_MAX_ENTRADAS', 128))
+
+# Permite desactivar la caché (p. ej. para depurar) con STORE_CACHE_DESACTIVADA=1
+CACHE_ACTIVADA = os.environ.get('STORE_CACHE_DESACTIVADA', '0') not in ('1', 'true', 'si', 'sí')
+
+# Marcador para distinguir "no está en caché" de un valor None cacheado
+_AUSENTE = object()
+
+
+class CacheTTL:
+    """
+    Caché acotada con caducidad por tiempo y expulsión LRU.
+
+    Attributes:
+        nombre (str): Nombre con el que se registra e invalida la caché
+        ttl (float): Segundos que una entrada se considera válida
+        max_entradas (int): Número máximo de entradas guardadas
+        aciertos (int): Lecturas servidas desde la caché
+        fallos (int): Lecturas que tuvieron que calcularse
+        expulsiones (int): Entradas descartadas por superar el tamaño máximo
+    """
+
+    def __init__(self, nombre, ttl, max_entradas=None):
+        """Inicializa una caché vacía."""
+        self.nombre = nombre
+        self.ttl = ttl
+        self.max_entradas = max_entradas or CACHE_MAX_ENTRADAS
+        self.aciertos = 0
+        self.fallos = 0
+        self.expulsiones = 0
+        self._entradas = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obtener(self, clave, defecto=_AUSENTE):
+        """
+        Busca una entrada vigente en la caché.
+
+        Args:
+            clave (tuple): Clave de la entrada
+            defecto (object, optional): Valor devuelto si no está o ha caducado
+
+        Returns:
+            object: Valor guardado, o ``defecto`` si no está o ha caducado
+        """
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is not None:
+                caduca, valor = entrada
+                if caduca > time.monotonic():
+                    self._entradas.move_to_end(clave)
+                    self.aciertos += 1
+                    return valor
+                del self._entradas[clave]
+            self.fallos += 1
+            return defecto
+
+    def guardar(self, clave, valor):
+        """
+        Guarda un valor en la caché, expulsando la entrada menos usada si hace falta.
+
+        Args:
+            clave (tuple): Clave de la entrada
+            valor (object): Valor a guardar
+        """
+        with self._lock:
+            self._entradas[clave] = (time.monotonic() + self.ttl, valor)
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+                self.expulsiones += 1
+
+    def invalidar(self):
+        """Descarta todas las entradas de la caché."""
+        with self._lock:
+            self._entradas.clear()
+
+    def estadisticas(self):
+        """
+        Obtiene los contadores de uso de la caché.
+
+        Returns:
+            dict: Entradas, aciertos, fallos, expulsiones y tasa de aciertos
+        """
+        with self._lock:
+            consultas = self.aciertos + self.fallos
+            return {
+                'ttl': self.ttl,
+                'entradas': len(self._entradas),
+                'max_entradas': self.max_entradas,
+                'aciertos': self.aciertos,
+                'fallos': self.fallos,
+                'expulsiones': self.expulsiones,
+                'tasa_aciertos': round(self.aciertos / consultas, 3) if consultas else None
+            }
+
+
+# Cachés registradas por nombre
+_caches = {}
+_caches_lock = threading.Lock()
+
+# Nombres de las cachés que dependen de cada tabla
+_dependencias = {}
+
+# Última versión vista de cada tabla por este proceso
+_versiones_vistas = {}
+
+
+def get_cache(nombre, ttl, max_entradas=None):
+    """
+    Obtiene (o crea) la caché registrada con un nombre.
+
+    Args:
+        nombre (str): Nombre de la caché
+        ttl (float): Segundos de vida de las entradas
+        max_entradas (int, optional): Tamaño máximo de la caché
+
+    Returns:
+        CacheTTL: Caché registrada
+    """
+    with _caches_lock:
+        cache = _caches.get(nombre)
+        if cache is None:
+            cache = _caches[nombre] = CacheTTL(nombre, ttl, max_entradas)
+        return cache
+
+
+def cacheado(nombre, ttl, max_entradas=None, tablas=()):
+    """
+    Decorador que cachea el resultado de una función según sus argumentos.
+
+    Las listas se devuelven como copia para que quien llama no altere la
+    entrada guardada. Se puede aplicar bajo @classmethod: ``cls`` forma parte
+    de la clave.
+
+    Args:
+        nombre (str): Nombre de la caché, usado también para invalidarla
+        ttl (float): Segundos de vida de cada resultado
+        max_entradas (int, optional): Número máximo de resultados distintos
+        tablas (tuple): Tablas cuyos cambios en otros procesos invalidan la caché
+
+    Returns:
+        function: Decorador
+    """
+    cache = get_cache(nombre, ttl, max_entradas)
+    with _caches_lock:
+        for tabla in tablas:
+            _dependencias.setdefault(tabla, set()).add(nombre)
+
+    def decorador(funcion):
+        @functools.wraps(funcion)
+        def envoltura(*args, **kwargs):
+            if not CACHE_ACTIVADA:
+                return funcion(*args, **kwargs)
+
+            clave = (args, tuple(sorted(kwargs.items())))
+            valor = cache.obtener(clave)
+            if valor is _AUSENTE:
+                valor = funcion(*args, **kwargs)
+                cache.guardar(clave, valor)
+            return list(valor) if isinstance(valor, list) else valor
+
+        envoltura.cache = cache
+        return envoltura
+
+    return decorador
+
+
+def invalidar(*nombres):
+    """
+    Invalida las cachés indicadas (o todas si no se indica ninguna).
+
+    Args:
+        *nombres (str): Nombres de las cachés a invalidar
+    """
+    with _caches_lock:
+        caches = [_caches[n] for n in nombres if n in _caches] if nombres else list(_caches.values())
+    for cache in caches:
+        cache.invalidar()
+
+
+def estadisticas():
+    """
+    Obtiene los contadores de todas las cachés registradas.
+
+    Returns:
+        dict: Estadísticas de cada caché por nombre
+    """
+    with _caches_lock:
+        caches = list(_caches.values())
+    return {cache.nombre: cache.estadisticas() for cache in caches}
+
+
+def sincronizar_versiones(versiones):
+    """
+    Invalida las cachés que dependen de tablas modificadas desde la última comprobación.
+
+    Args:
+        versiones (dict): Versión actual de cada tabla en la base de datos
+
+    Returns:
+        list: Tablas cuya versión ha cambiado
+    """
+    with _caches_lock:
+        cambiadas = [tabla for tabla, version in versiones.items()
+                     if _versiones_vistas.get(tabla) != version]
+        if not cambiadas:
+            return []
+        nombres = set()
+        for tabla in cambiadas:
+            _versiones_vistas[tabla] = versiones[tabla]
+            nombres.update(_dependencias.get(tabla, ()))
+        caches = [_caches[n] for n in nombres if n in _caches]
+    for cache in caches:
+        cache.invalidar()
+    return cambiadas
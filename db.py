@@ -1,210 +1,1584 @@
-"""
-Módulo para gestionar la conexión a la base de datos.
-
-Este módulo proporciona funciones para crear una conexión a la base de datos SQLite,
-inicializar tablas y gestionar la sesión de base de datos.
-
-"""
-
-import sqlite3
-import os
-from contextlib import contextmanager
-
-# Ruta del directorio de la base de datos
-DB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'database')
-DB_PATH = os.path.join(DB_DIR, 'store_componentes.db')
-SQL_PATH = os.path.join(DB_DIR, 'store_componentes.sql')
-
-
-def crear_directorio_db():
-    """
-    Crea el directorio de la base de datos si no existe.
-    """
-    if not os.path.exists(DB_DIR):
-        os.makedirs(DB_DIR)
-
-
-def get_db_connection():
-    """
-    Establece una conexión con la base de datos SQLite.
-
-    Returns:
-        sqlite3.Connection: Objeto de conexión a la base de datos
-    """
-    crear_directorio_db()
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row  # Para acceder a las columnas por nombre
-    return conn
-
-
-@contextmanager
-def get_db():
-    """
-    Context manager para gestionar la conexión a la base de datos.
-
-    Yields:
-        sqlite3.Connection: Objeto de conexión a la base de datos
-    """
-    conn = get_db_connection()
-    try:
-        yield conn
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
-        raise e
-    finally:
-        conn.close()
-
-
-def inicializar_db():
-    """
-    Inicializa la base de datos creando todas las tablas necesarias
-    si no existen.
-    """
-    crear_directorio_db()
-
-    # Verificar si la base de datos existe y tiene tablas
-    db_existe = os.path.exists(DB_PATH) and os.path.getsize(DB_PATH) > 0
-
-    with get_db() as conn:
-        cursor = conn.cursor()
-
-        if not db_existe:
-            print("Base de datos no encontrada o vacía. Inicializando...")
-
-            # Verificar si existe el script SQL
-            if os.path.exists(SQL_PATH):
-                print(f"Ejecutando script SQL desde: {SQL_PATH}")
-                with open(SQL_PATH, 'r', encoding='utf-8') as sql_file:
-                    sql_script = sql_file.read()
-
-                # Ejecutar el script SQL
-                cursor.executescript(sql_script)
-                print("Base de datos inicializada correctamente desde script SQL.")
-            else:
-                print("Script SQL no encontrado. Se inicializarán las tablas manualmente.")
-                # Crear las tablas manualmente
-                crear_tablas_manualmente(cursor)
-        else:
-            # Comprobar si hay tablas
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-            tablas = cursor.fetchall()
-            if not tablas:
-                # La base de datos existe pero está vacía
-                if os.path.exists(SQL_PATH):
-                    print(f"Base de datos vacía. Ejecutando script SQL desde: {SQL_PATH}")
-                    with open(SQL_PATH, 'r', encoding='utf-8') as sql_file:
-                        sql_script = sql_file.read()
-
-                    # Ejecutar el script SQL
-                    cursor.executescript(sql_script)
-                    print("Base de datos inicializada correctamente desde script SQL.")
-                else:
-                    print("Script SQL no encontrado. Se inicializarán las tablas manualmente.")
-                    crear_tablas_manualmente(cursor)
-            else:
-                print(f"Base de datos encontrada con {len(tablas)} tablas.")
-
-
-def crear_tablas_manualmente(cursor):
-    """
-    Crea las tablas de la base de datos manualmente.
-
-    Args:
-        cursor: Cursor de la conexión a la base de datos
-    """
-    # Crear tabla de usuarios
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS usuarios (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            email TEXT UNIQUE NOT NULL,
-            password TEXT NOT NULL,
-            es_admin BOOLEAN DEFAULT 0,
-            fecha_registro TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-
-    # Crear tabla de proveedores
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS proveedores (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        nombre TEXT NOT NULL,
-        cif TEXT UNIQUE NOT NULL,
-        direccion TEXT,
-        telefono TEXT,
-        email TEXT,
-        porcentaje_descuento REAL DEFAULT 0,
-        iva REAL DEFAULT 21,
-        notas TEXT
-    )
-    ''')
-
-    # Crear tabla de productos
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS productos (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        nombre TEXT NOT NULL,
-        referencia TEXT UNIQUE NOT NULL,
-        descripcion TEXT,
-        precio_compra REAL NOT NULL,
-        precio_venta REAL NOT NULL,
-        stock_actual INTEGER DEFAULT 0,
-        stock_minimo INTEGER DEFAULT 0,
-        ubicacion_almacen TEXT,
-        categoria TEXT,
-        imagen TEXT,
-        proveedor_id INTEGER,
-        FOREIGN KEY (proveedor_id) REFERENCES proveedores (id)
-    )
-    ''')
-
-    # Crear tabla de ventas (pedidos de clientes)
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS ventas (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        cliente_id INTEGER NOT NULL,
-        fecha TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        total REAL DEFAULT 0,
-        FOREIGN KEY (cliente_id) REFERENCES usuarios (id)
-    )
-    ''')
-
-    # Crear tabla de detalle de ventas
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS ventas_detalle (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        venta_id INTEGER NOT NULL,
-        producto_id INTEGER NOT NULL,
-        cantidad INTEGER NOT NULL,
-        precio_unitario REAL NOT NULL,
-        FOREIGN KEY (venta_id) REFERENCES ventas (id),
-        FOREIGN KEY (producto_id) REFERENCES productos (id)
-    )
-    ''')
-
-    # Crear tabla de compras (a proveedores)
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS compras (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        proveedor_id INTEGER NOT NULL,
-        fecha TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        total REAL DEFAULT 0,
-        FOREIGN KEY (proveedor_id) REFERENCES proveedores (id)
-    )
-    ''')
-
-    # Crear tabla de detalle de compras
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS compras_detalle (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        compra_id INTEGER NOT NULL,
-        producto_id INTEGER NOT NULL,
-        cantidad INTEGER NOT NULL,
-        precio_unitario REAL NOT NULL,
-        FOREIGN KEY (compra_id) REFERENCES compras (id),
-        FOREIGN KEY (producto_id) REFERENCES productos (id)
-    )
-    ''')
-
+"""
+Módulo para gestionar la conexión a la base de datos.
+
+Este módulo proporciona funciones para crear una conexión a la base de datos SQLite,
+inicializar tablas y gestionar la sesión de base de datos. Las conexiones se
+reutilizan mediante un pool para no abrir y cerrar la base de datos en cada consulta.
+
+"""
+
+import sqlite3
+import os
+import re
+import csv
+import json
+import time
+import atexit
+import queue
+import threading
+from contextlib import contextmanager
+
+# Ruta del directorio de la base de datos
+DB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'database')
+DB_PATH = os.path.join(DB_DIR, 'store_componentes.db')
+SQL_PATH = os.path.join(DB_DIR, 'store_componentes.sql')
+
+# Filas por lote en las cargas masivas (sembrar_db / importar_datos)
+LOTE_CARGA = int(os.environ.get('STORE_DB_LOTE_CARGA', 5000))
+
+# Tablas en las que se pueden hacer cargas masivas
+TABLAS_CARGA = ('usuarios', 'proveedores', 'productos', 'ventas', 'ventas_detalle',
+                'compras', 'compras_detalle')
+
+# Configuración del pool de conexiones
+DB_POOL_SIZE = int(os.environ.get('STORE_DB_POOL_SIZE', 5))
+DB_POOL_TIMEOUT = float(os.environ.get('STORE_DB_POOL_TIMEOUT', 30))
+
+# Perfiles de PRAGMA aplicados a cada conexión del pool. El orden importa:
+# busy_timeout se fija primero para que el cambio de journal_mode pueda esperar.
+PERFILES_PRAGMA = {
+    # Lecturas concurrentes con escrituras (WAL) y sincronización reducida
+    'rendimiento': {
+        'busy_timeout': 5000,
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -20000,  # En KiB (~20 MB)
+        'mmap_size': 268435456,  # 256 MB
+        'temp_store': 'MEMORY',
+    },
+    # WAL con sincronización completa en cada commit
+    'durable': {
+        'busy_timeout': 5000,
+        'journal_mode': 'WAL',
+        'synchronous': 'FULL',
+        'cache_size': -20000,
+        'mmap_size': 0,
+        'temp_store': 'DEFAULT',
+    },
+    # Comportamiento por defecto de SQLite (rollback journal)
+    'compatible': {
+        'busy_timeout': 5000,
+        'journal_mode': 'DELETE',
+        'synchronous': 'FULL',
+        'cache_size': -2000,
+        'mmap_size': 0,
+        'temp_store': 'DEFAULT',
+    },
+}
+DB_PRAGMA_PROFILE = os.environ.get('STORE_DB_PRAGMAS', 'rendimiento')
+
+
+def sql_coste_venta(producto, venta):
+    """
+    Genera la expresión SQL del coste unitario de un producto al venderlo.
+
+    El coste es el precio de la última línea de compra del producto con fecha
+    igual o anterior a la de la venta. Si el producto no tiene compras
+    registradas hasta entonces se usa su ``precio_compra`` de catálogo en el
+    momento de calcularlo: al registrar la venta es el vigente, pero para las
+    ventas anteriores a guardar el coste es solo una aproximación.
+
+    Args:
+        producto (str): Expresión SQL con el ID del producto
+        venta (str): Expresión SQL con el ID de la venta
+
+    Returns:
+        str: Expresión SQL
+    """
+    return f"""COALESCE(
+            (SELECT cd.precio_unitario
+             FROM compras_detalle cd
+             JOIN compras c ON c.id = cd.compra_id
+             WHERE cd.producto_id = {producto}
+               AND datetime(c.fecha) <= (SELECT datetime(fecha) FROM ventas WHERE id = {venta})
+             ORDER BY datetime(c.fecha) DESC, cd.id DESC
+             LIMIT 1),
+            (SELECT precio_compra FROM productos WHERE id = {producto})
+        )"""
+
+
+# Recalcula el resumen de beneficios por proveedor a partir del coste y el
+# proveedor guardados en cada línea de venta
+SQL_RESUMEN_BENEFICIOS = """
+        INSERT INTO beneficios_proveedor_diarios (fecha, proveedor_id, beneficio)
+        SELECT date(v.fecha), d.proveedor_id,
+               SUM((d.precio_unitario - d.coste_unitario) * d.cantidad)
+        FROM ventas_detalle d
+        JOIN ventas v ON v.id = d.venta_id
+        WHERE d.proveedor_id IS NOT NULL
+        GROUP BY date(v.fecha), d.proveedor_id
+"""
+
+
+def _sql_versionar_tabla(tabla):
+    """
+    Genera los triggers que incrementan la versión de una tabla en cada escritura.
+
+    El incremento ocurre dentro de la misma transacción que la escritura, así que
+    otros procesos solo ven la versión nueva cuando los datos ya están confirmados.
+
+    Args:
+        tabla (str): Nombre de la tabla a versionar
+
+    Returns:
+        list: Sentencias SQL a ejecutar
+    """
+    sentencias = [
+        f"INSERT OR IGNORE INTO versiones_tablas (tabla, version) VALUES ('{tabla}', 0)"
+    ]
+    for evento in ('INSERT', 'UPDATE', 'DELETE'):
+        sentencias.append(f"""
+        CREATE TRIGGER IF NOT EXISTS {tabla}_version_{evento.lower()} AFTER {evento} ON {tabla}
+        BEGIN
+            UPDATE versiones_tablas SET version = version + 1 WHERE tabla = '{tabla}';
+        END
+        """)
+    return sentencias
+
+
+# Migraciones del esquema: (versión, nombre, sentencias SQL). Se aplican en orden
+# sobre cualquier base de datos, nueva o existente, y nunca se modifican una vez
+# publicadas: los cambios posteriores se añaden como una versión nueva.
+MIGRACIONES = [
+    (1, 'indices_claves_ajenas_y_fechas', [
+        # Ventas: listados por fecha, filtros por cliente y estadísticas
+        "CREATE INDEX IF NOT EXISTS idx_ventas_fecha ON ventas (fecha)",
+        "CREATE INDEX IF NOT EXISTS idx_ventas_cliente_fecha ON ventas (cliente_id, fecha)",
+        "CREATE INDEX IF NOT EXISTS idx_ventas_detalle_venta ON ventas_detalle (venta_id)",
+        "CREATE INDEX IF NOT EXISTS idx_ventas_detalle_producto ON ventas_detalle (producto_id)",
+        # Compras: listados por fecha y por proveedor
+        "CREATE INDEX IF NOT EXISTS idx_compras_fecha ON compras (fecha)",
+        "CREATE INDEX IF NOT EXISTS idx_compras_proveedor_fecha ON compras (proveedor_id, fecha)",
+        "CREATE INDEX IF NOT EXISTS idx_compras_detalle_compra ON compras_detalle (compra_id)",
+        "CREATE INDEX IF NOT EXISTS idx_compras_detalle_producto ON compras_detalle (producto_id)",
+        # Productos: catálogo ordenado por nombre, filtros por proveedor y categoría
+        "CREATE INDEX IF NOT EXISTS idx_productos_nombre ON productos (nombre)",
+        "CREATE INDEX IF NOT EXISTS idx_productos_proveedor_nombre ON productos (proveedor_id, nombre)",
+        "CREATE INDEX IF NOT EXISTS idx_productos_categoria_nombre ON productos (categoria, nombre)",
+        # Proveedores ordenados por nombre en formularios y listados
+        "CREATE INDEX IF NOT EXISTS idx_proveedores_nombre ON proveedores (nombre)",
+        "ANALYZE",
+    ]),
+    (2, 'busqueda_texto_completo_productos', [
+        # Índice FTS5 con contenido externo: solo guarda el índice, no los textos
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS productos_fts USING fts5(
+            nombre, referencia, descripcion, categoria,
+            content='productos', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2',
+            prefix='2 3'
+        )
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS productos_fts_insert AFTER INSERT ON productos BEGIN
+            INSERT INTO productos_fts (rowid, nombre, referencia, descripcion, categoria)
+            VALUES (new.id, new.nombre, new.referencia, new.descripcion, new.categoria);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS productos_fts_delete AFTER DELETE ON productos BEGIN
+            INSERT INTO productos_fts (productos_fts, rowid, nombre, referencia, descripcion, categoria)
+            VALUES ('delete', old.id, old.nombre, old.referencia, old.descripcion, old.categoria);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS productos_fts_update
+        AFTER UPDATE OF nombre, referencia, descripcion, categoria ON productos BEGIN
+            INSERT INTO productos_fts (productos_fts, rowid, nombre, referencia, descripcion, categoria)
+            VALUES ('delete', old.id, old.nombre, old.referencia, old.descripcion, old.categoria);
+            INSERT INTO productos_fts (rowid, nombre, referencia, descripcion, categoria)
+            VALUES (new.id, new.nombre, new.referencia, new.descripcion, new.categoria);
+        END
+        """,
+        # Indexar los productos que ya existían
+        "INSERT INTO productos_fts (productos_fts) VALUES ('rebuild')",
+    ]),
+    (3, 'busqueda_usuarios_trigramas', [
+        # Índice de trigramas: permite buscar cualquier subcadena de 3 o más caracteres
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS usuarios_fts USING fts5(
+            username, email,
+            content='usuarios', content_rowid='id',
+            tokenize='trigram'
+        )
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS usuarios_fts_insert AFTER INSERT ON usuarios BEGIN
+            INSERT INTO usuarios_fts (rowid, username, email)
+            VALUES (new.id, new.username, new.email);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS usuarios_fts_delete AFTER DELETE ON usuarios BEGIN
+            INSERT INTO usuarios_fts (usuarios_fts, rowid, username, email)
+            VALUES ('delete', old.id, old.username, old.email);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS usuarios_fts_update
+        AFTER UPDATE OF username, email ON usuarios BEGIN
+            INSERT INTO usuarios_fts (usuarios_fts, rowid, username, email)
+            VALUES ('delete', old.id, old.username, old.email);
+            INSERT INTO usuarios_fts (rowid, username, email)
+            VALUES (new.id, new.username, new.email);
+        END
+        """,
+        "INSERT INTO usuarios_fts (usuarios_fts) VALUES ('rebuild')",
+        # Búsquedas de menos de 3 caracteres: prefijo de username sin distinguir mayúsculas
+        "CREATE INDEX IF NOT EXISTS idx_usuarios_username_nocase ON usuarios (username COLLATE NOCASE)",
+    ]),
+    (4, 'resumen_ventas_diarias', [
+        """
+        CREATE TABLE IF NOT EXISTS ventas_diarias (
+            fecha DATE NOT NULL,
+            cliente_id INTEGER NOT NULL,
+            total REAL NOT NULL DEFAULT 0,
+            num_ventas INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (fecha, cliente_id)
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_ventas_diarias_cliente ON ventas_diarias (cliente_id, fecha)",
+        "DELETE FROM ventas_diarias",
+        """
+        INSERT INTO ventas_diarias (fecha, cliente_id, total, num_ventas)
+        SELECT date(fecha), cliente_id, SUM(total), COUNT(*)
+        FROM ventas
+        GROUP BY date(fecha), cliente_id
+        """,
+    ]),
+    (5, 'resumen_productos_vendidos_diarios', [
+        """
+        CREATE TABLE IF NOT EXISTS ventas_productos_diarias (
+            fecha DATE NOT NULL,
+            cliente_id INTEGER NOT NULL,
+            producto_id INTEGER NOT NULL,
+            cantidad INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (fecha, cliente_id, producto_id)
+        ) WITHOUT ROWID
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_ventas_productos_diarias_cliente
+        ON ventas_productos_diarias (cliente_id, fecha)
+        """,
+        "DELETE FROM ventas_productos_diarias",
+        """
+        INSERT INTO ventas_productos_diarias (fecha, cliente_id, producto_id, cantidad)
+        SELECT date(v.fecha), v.cliente_id, d.producto_id, SUM(d.cantidad)
+        FROM ventas_detalle d
+        JOIN ventas v ON v.id = d.venta_id
+        GROUP BY date(v.fecha), v.cliente_id, d.producto_id
+        """,
+    ]),
+    (6, 'coste_historico_y_resumen_beneficios', [
+        # Coste del producto en el momento de la venta (véase sql_coste_venta). Para
+        # las ventas anteriores sin compras previas del producto el coste es
+        # aproximado: el precio de compra de catálogo al aplicar la migración.
+        "ALTER TABLE ventas_detalle ADD COLUMN coste_unitario REAL",
+        f"""
+        UPDATE ventas_detalle
+        SET coste_unitario = {sql_coste_venta('ventas_detalle.producto_id', 'ventas_detalle.venta_id')}
+        WHERE coste_unitario IS NULL
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS beneficios_proveedor_diarios (
+            fecha DATE NOT NULL,
+            proveedor_id INTEGER NOT NULL,
+            beneficio REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (fecha, proveedor_id)
+        ) WITHOUT ROWID
+        """,
+        "DELETE FROM beneficios_proveedor_diarios",
+        """
+        INSERT INTO beneficios_proveedor_diarios (fecha, proveedor_id, beneficio)
+        SELECT date(v.fecha), p.proveedor_id,
+               SUM((d.precio_unitario - d.coste_unitario) * d.cantidad)
+        FROM ventas_detalle d
+        JOIN ventas v ON v.id = d.venta_id
+        JOIN productos p ON p.id = d.producto_id
+        WHERE p.proveedor_id IS NOT NULL
+        GROUP BY date(v.fecha), p.proveedor_id
+        """,
+    ]),
+    (7, 'stock_critico_indice_parcial_y_versiones', [
+        # Índice parcial: solo contiene los productos con stock crítico
+        """
+        CREATE INDEX IF NOT EXISTS idx_productos_stock_critico ON productos (stock_minimo)
+        WHERE stock_actual <= stock_minimo AND stock_minimo > 0
+        """,
+        # Última versión en la que cambió cada producto que entra, está o sale del stock crítico
+        """
+        CREATE TABLE IF NOT EXISTS stock_critico_versiones (
+            producto_id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_stock_critico_versiones_version ON stock_critico_versiones (version)",
+        """
+        INSERT OR REPLACE INTO stock_critico_versiones (producto_id, version)
+        SELECT id, 1 FROM productos
+        WHERE stock_actual <= stock_minimo AND stock_minimo > 0
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS stock_critico_insert AFTER INSERT ON productos
+        WHEN new.stock_actual <= new.stock_minimo AND new.stock_minimo > 0
+        BEGIN
+            INSERT OR REPLACE INTO stock_critico_versiones (producto_id, version)
+            VALUES (new.id, (SELECT IFNULL(MAX(version), 0) + 1 FROM stock_critico_versiones));
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS stock_critico_update
+        AFTER UPDATE OF nombre, stock_actual, stock_minimo ON productos
+        WHEN ((old.stock_actual <= old.stock_minimo AND old.stock_minimo > 0)
+              OR (new.stock_actual <= new.stock_minimo AND new.stock_minimo > 0))
+             AND (old.nombre IS NOT new.nombre
+                  OR old.stock_actual IS NOT new.stock_actual
+                  OR old.stock_minimo IS NOT new.stock_minimo)
+        BEGIN
+            INSERT OR REPLACE INTO stock_critico_versiones (producto_id, version)
+            VALUES (new.id, (SELECT IFNULL(MAX(version), 0) + 1 FROM stock_critico_versiones));
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS stock_critico_delete AFTER DELETE ON productos
+        WHEN old.stock_actual <= old.stock_minimo AND old.stock_minimo > 0
+        BEGIN
+            INSERT OR REPLACE INTO stock_critico_versiones (producto_id, version)
+            VALUES (old.id, (SELECT IFNULL(MAX(version), 0) + 1 FROM stock_critico_versiones));
+        END
+        """,
+    ]),
+    (8, 'versiones_tablas_para_invalidar_caches', [
+        # Versión de cada tabla cacheada en memoria: los procesos la comparan en cada
+        # petición para descartar las cachés que otro proceso ha dejado obsoletas
+        """
+        CREATE TABLE IF NOT EXISTS versiones_tablas (
+            tabla TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+        """,
+        *_sql_versionar_tabla('productos'),
+        *_sql_versionar_tabla('proveedores'),
+    ]),
+    (9, 'versiones_tablas_ventas', [
+        # Las respuestas de estadísticas y ventas se validan con ETags basados en estas versiones
+        *_sql_versionar_tabla('ventas'),
+        *_sql_versionar_tabla('ventas_detalle'),
+    ]),
+    (10, 'versiones_tablas_usuarios', [
+        # El usuario de la sesión se cachea en memoria en cada proceso
+        *_sql_versionar_tabla('usuarios'),
+    ]),
+    (11, 'proveedor_historico_en_ventas', [
+        # Proveedor del producto en el momento de la venta: los beneficios se le
+        # atribuyen aunque el producto cambie después de proveedor. Para las ventas
+        # anteriores solo se conoce el proveedor actual.
+        "ALTER TABLE ventas_detalle ADD COLUMN proveedor_id INTEGER",
+        """
+        UPDATE ventas_detalle
+        SET proveedor_id = (SELECT proveedor_id FROM productos WHERE id = ventas_detalle.producto_id)
+        """,
+        # Completar los costes que no se pudieron calcular al guardar el coste histórico
+        f"""
+        UPDATE ventas_detalle
+        SET coste_unitario = {sql_coste_venta('ventas_detalle.producto_id', 'ventas_detalle.venta_id')}
+        WHERE coste_unitario IS NULL
+        """,
+        "DELETE FROM beneficios_proveedor_diarios",
+        SQL_RESUMEN_BENEFICIOS,
+    ]),
+]
+
+# Versión del esquema tras aplicar todas las migraciones. Se guarda también en
+# PRAGMA user_version para que el arranque pueda comprobarla con una sola lectura.
+ESQUEMA_VERSION = MIGRACIONES[-1][0]
+
+# Tablas FTS5 de contenido externo que pueden reconstruirse, con su tabla origen
+INDICES_BUSQUEDA = {'productos_fts': 'productos', 'usuarios_fts': 'usuarios'}
+
+# Tablas de resumen mantenidas por los modelos y la consulta que las recalcula desde cero
+RESUMENES = {
+    'ventas_diarias': """
+        INSERT INTO ventas_diarias (fecha, cliente_id, total, num_ventas)
+        SELECT date(fecha), cliente_id, SUM(total), COUNT(*)
+        FROM ventas
+        GROUP BY date(fecha), cliente_id
+    """,
+    'ventas_productos_diarias': """
+        INSERT INTO ventas_productos_diarias (fecha, cliente_id, producto_id, cantidad)
+        SELECT date(v.fecha), v.cliente_id, d.producto_id, SUM(d.cantidad)
+        FROM ventas_detalle d
+        JOIN ventas v ON v.id = d.venta_id
+        GROUP BY date(v.fecha), v.cliente_id, d.producto_id
+    """,
+    'beneficios_proveedor_diarios': SQL_RESUMEN_BENEFICIOS,
+}
+
+
+def crear_directorio_db():
+    """
+    Crea el directorio de la base de datos si no existe.
+    """
+    if not os.path.exists(DB_DIR):
+        os.makedirs(DB_DIR)
+
+
+def get_perfil_pragmas(nombre=None):
+    """
+    Obtiene los PRAGMA de un perfil de configuración.
+
+    Args:
+        nombre (str, optional): Nombre del perfil; por defecto ``DB_PRAGMA_PROFILE``
+
+    Returns:
+        dict: PRAGMA y valores del perfil
+
+    Raises:
+        ValueError: Si el perfil no existe
+    """
+    nombre = nombre or DB_PRAGMA_PROFILE
+    if nombre not in PERFILES_PRAGMA:
+        raise ValueError(f"Perfil de PRAGMA desconocido: {nombre}")
+    return PERFILES_PRAGMA[nombre]
+
+
+def aplicar_pragmas(conn, pragmas):
+    """
+    Aplica un conjunto de PRAGMA a una conexión.
+
+    Args:
+        conn (sqlite3.Connection): Conexión a configurar
+        pragmas (dict): PRAGMA y valores a aplicar
+    """
+    for nombre, valor in pragmas.items():
+        conn.execute(f"PRAGMA {nombre} = {valor}")
+
+
+def leer_pragmas(conn, nombres):
+    """
+    Lee el valor efectivo de varios PRAGMA.
+
+    Args:
+        conn (sqlite3.Connection): Conexión a consultar
+        nombres (iterable): Nombres de los PRAGMA
+
+    Returns:
+        dict: Valor actual de cada PRAGMA
+    """
+    return {nombre: conn.execute(f"PRAGMA {nombre}").fetchone()[0] for nombre in nombres}
+
+
+def get_db_connection():
+    """
+    Establece una conexión con la base de datos SQLite.
+
+    Returns:
+        sqlite3.Connection: Objeto de conexión a la base de datos
+    """
+    crear_directorio_db()
+    conn = sqlite3.connect(DB_PATH)
+    conn.row_factory = sqlite3.Row  # Para acceder a las columnas por nombre
+    return conn
+
+
+class ConnectionPool:
+    """
+    Pool de conexiones SQLite reutilizables.
+
+    Mantiene como máximo ``tamano`` conexiones abiertas. Un hilo que ya tiene una
+    conexión prestada la reutiliza en las llamadas anidadas, de modo que todas las
+    operaciones de ese hilo comparten conexión y transacción.
+
+    Attributes:
+        db_path (str): Ruta del fichero de base de datos
+        tamano (int): Número máximo de conexiones abiertas
+        timeout (float): Segundos de espera cuando todas las conexiones están en uso
+        pragmas (dict): PRAGMA aplicados una vez a cada conexión nueva
+    """
+
+    def __init__(self, db_path, tamano=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT, pragmas=None):
+        """Inicializa el pool sin abrir ninguna conexión."""
+        self.db_path = db_path
+        self.pragmas = pragmas or {}
+        self.tamano = max(1, tamano)
+        self.timeout = timeout
+        self.pid = os.getpid()
+        self._libres = queue.LifoQueue()
+        self._abiertas = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._lectura = threading.local()
+        self._lecturas = []
+        self._cerrado = False
+
+    def _conectar(self):
+        """Abre una conexión nueva configurada para el pool."""
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row  # Para acceder a las columnas por nombre
+        aplicar_pragmas(conn, self.pragmas)
+        return conn
+
+    def _descartar(self, conn):
+        """Cierra una conexión y libera su hueco en el pool."""
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            self._abiertas -= 1
+
+    @staticmethod
+    def _es_valida(conn):
+        """
+        Comprueba que una conexión sigue siendo utilizable.
+
+        Args:
+            conn (sqlite3.Connection): Conexión a comprobar
+
+        Returns:
+            bool: True si la conexión responde, False en caso contrario
+        """
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def conexion_actual(self):
+        """
+        Devuelve la conexión prestada al hilo actual, si la hay.
+
+        Returns:
+            sqlite3.Connection: Conexión del hilo o None
+        """
+        return getattr(self._local, 'conn', None)
+
+    def adquirir(self):
+        """
+        Presta una conexión al hilo actual.
+
+        Si el hilo ya tiene una conexión prestada se devuelve la misma y se
+        incrementa su nivel de anidamiento.
+
+        Returns:
+            sqlite3.Connection: Conexión lista para usar
+
+        Raises:
+            sqlite3.OperationalError: Si el pool está cerrado o no quedan
+                conexiones libres tras esperar ``timeout`` segundos
+        """
+        conn = self.conexion_actual()
+        if conn is not None:
+            self._local.nivel += 1
+            return conn
+
+        if self._cerrado:
+            raise sqlite3.OperationalError("El pool de conexiones está cerrado")
+
+        conn = None
+        while conn is None:
+            try:
+                conn = self._libres.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    puede_abrir = self._abiertas < self.tamano
+                    if puede_abrir:
+                        self._abiertas += 1
+                if puede_abrir:
+                    try:
+                        conn = self._conectar()
+                    except Exception:
+                        with self._lock:
+                            self._abiertas -= 1
+                        raise
+                    break
+                try:
+                    conn = self._libres.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise sqlite3.OperationalError(
+                        "No hay conexiones libres en el pool de base de datos")
+
+            # Comprobar que la conexión reutilizada sigue siendo válida
+            if not self._es_valida(conn):
+                self._descartar(conn)
+                conn = None
+
+        self._local.conn = conn
+        self._local.nivel = 1
+        self._local.fallida = False
+        return conn
+
+    def marcar_fallida(self):
+        """
+        Marca la transacción del hilo actual para que se deshaga al terminar.
+
+        Se usa cuando falla una operación anidada cuyo error captura el código
+        que la llamó, para no confirmar un trabajo a medias.
+        """
+        if self.conexion_actual() is not None:
+            self._local.fallida = True
+
+    def transaccion_fallida(self):
+        """
+        Indica si la transacción del hilo actual debe deshacerse.
+
+        Returns:
+            bool: True si alguna operación de la transacción ha fallado
+        """
+        return getattr(self._local, 'fallida', False)
+
+    def liberar(self, conn):
+        """
+        Devuelve una conexión al pool.
+
+        Solo se devuelve realmente cuando se libera el préstamo más externo del
+        hilo. Si quedara una transacción abierta se deshace antes de reutilizarla.
+
+        Args:
+            conn (sqlite3.Connection): Conexión obtenida con ``adquirir``
+        """
+        self._local.nivel -= 1
+        if self._local.nivel > 0:
+            return
+
+        self._local.conn = None
+
+        if self._cerrado:
+            self._descartar(conn)
+            return
+
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self._descartar(conn)
+            return
+
+        self._libres.put(conn)
+
+    @contextmanager
+    def conexion_lectura(self):
+        """
+        Usa en el hilo actual una conexión de solo lectura ajena al pool.
+
+        Pensada para hilos auxiliares (p. ej. el cálculo en paralelo del panel de
+        estadísticas): cada hilo abre su propia conexión la primera vez y la
+        reutiliza después, sin ocupar ninguna de las ``tamano`` conexiones que
+        usan las peticiones. Dentro del bloque, ``adquirir`` (y por tanto
+        ``get_db()``) devuelve esa conexión en el hilo.
+
+        Yields:
+            sqlite3.Connection: Conexión de solo lectura del hilo
+
+        Raises:
+            RuntimeError: Si el hilo ya tiene una conexión del pool prestada
+        """
+        if self.conexion_actual() is not None:
+            raise RuntimeError("El hilo ya tiene una conexión del pool prestada")
+        if self._cerrado:
+            raise sqlite3.OperationalError("El pool de conexiones está cerrado")
+
+        conn = getattr(self._lectura, 'conn', None)
+        if conn is None:
+            conn = self._conectar()
+            conn.execute("PRAGMA query_only = ON")
+            self._lectura.conn = conn
+            with self._lock:
+                self._lecturas.append(conn)
+
+        self._local.conn = conn
+        self._local.nivel = 1
+        self._local.fallida = False
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            self._local.nivel = 0
+            if conn.in_transaction:
+                conn.rollback()
+
+    def cerrar(self):
+        """Cierra todas las conexiones libres e impide nuevos préstamos."""
+        self._cerrado = True
+        while True:
+            try:
+                conn = self._libres.get_nowait()
+            except queue.Empty:
+                break
+            self._descartar(conn)
+        with self._lock:
+            lecturas, self._lecturas = self._lecturas, []
+        for conn in lecturas:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """
+    Obtiene el pool de conexiones del proceso, creándolo si es necesario.
+
+    El pool se vuelve a crear si el proceso se ha bifurcado (por ejemplo, en los
+    workers de gunicorn) para no compartir conexiones entre procesos.
+
+    Returns:
+        ConnectionPool: Pool de conexiones activo
+    """
+    global _pool
+    pool = _pool
+    if pool is None or pool.pid != os.getpid() or pool.db_path != DB_PATH:
+        with _pool_lock:
+            pool = _pool
+            if pool is None or pool.pid != os.getpid() or pool.db_path != DB_PATH:
+                if pool is not None and pool.pid == os.getpid():
+                    pool.cerrar()
+                crear_directorio_db()
+                pool = ConnectionPool(DB_PATH, pragmas=get_perfil_pragmas())
+                _pool = pool
+    return pool
+
+
+def cerrar_pool():
+    """
+    Cierra el pool de conexiones del proceso.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool.pid == os.getpid():
+            _pool.cerrar()
+        _pool = None
+
+
+atexit.register(cerrar_pool)
+
+
+class UnidadDeTrabajo:
+    """
+    Transacción compartida por todas las operaciones de base de datos de un hilo.
+
+    Mientras está abierta, cada llamada a ``get_db()`` del mismo hilo reutiliza su
+    conexión sin confirmar, de forma que todo el trabajo se confirma (o se deshace)
+    de una sola vez. En la aplicación web se abre una por petición y se guarda en
+    ``flask.g``; fuera de ella puede usarse como context manager.
+
+    Attributes:
+        conn (sqlite3.Connection): Conexión de la transacción
+    """
+
+    def __init__(self):
+        """Abre la unidad de trabajo tomando una conexión del pool."""
+        self._pool = get_pool()
+        self.conn = self._pool.adquirir()
+        self._confirmada = False
+
+    def revertir(self):
+        """Marca la unidad de trabajo para que se deshaga en lugar de confirmarse."""
+        self._pool.marcar_fallida()
+
+    def confirmar(self):
+        """
+        Confirma todos los cambios pendientes, salvo que se haya marcado como fallida.
+
+        Returns:
+            bool: True si los cambios se han confirmado
+        """
+        if self.conn is None or self._confirmada:
+            return self._confirmada
+        if self._pool.transaccion_fallida():
+            self.conn.rollback()
+            return False
+        self.conn.commit()
+        self._confirmada = True
+        return True
+
+    def cerrar(self, error=None):
+        """
+        Devuelve la conexión al pool deshaciendo lo que no se haya confirmado.
+
+        Args:
+            error (Exception, optional): Excepción que ha interrumpido el trabajo
+        """
+        if self.conn is None:
+            return
+        try:
+            if error is not None or not self._confirmada:
+                self.conn.rollback()
+        finally:
+            self._pool.liberar(self.conn)
+            self.conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is None:
+            self.confirmar()
+        self.cerrar(exc)
+        return False
+
+
+@contextmanager
+def get_db():
+    """
+    Context manager para gestionar la conexión a la base de datos.
+
+    La conexión se toma del pool y se devuelve al salir. Si el hilo ya tenía una
+    conexión abierta (llamadas anidadas o una ``UnidadDeTrabajo`` activa), se
+    reutiliza y la confirmación o reversión se deja al bloque más externo.
+
+    Yields:
+        sqlite3.Connection: Objeto de conexión a la base de datos
+    """
+    pool = get_pool()
+    externa = pool.conexion_actual() is None
+    conn = pool.adquirir()
+    try:
+        yield conn
+        if externa:
+            if pool.transaccion_fallida():
+                conn.rollback()
+            else:
+                conn.commit()
+    except Exception as e:
+        if externa:
+            conn.rollback()
+        else:
+            pool.marcar_fallida()
+        raise e
+    finally:
+        pool.liberar(conn)
+
+
+def conexion_lectura():
+    """
+    Context manager que da al hilo actual una conexión de solo lectura propia.
+
+    La conexión no sale del pool de las peticiones (véase
+    ``ConnectionPool.conexion_lectura``), así que los hilos auxiliares que la usan
+    no pueden agotarlo.
+
+    Returns:
+        contextmanager: Bloque que produce la conexión del hilo
+    """
+    return get_pool().conexion_lectura()
+
+
+def inicializar_db():
+    """
+    Inicializa la base de datos creando todas las tablas necesarias
+    si no existen.
+    """
+    crear_directorio_db()
+
+    # Verificar si la base de datos existe y tiene tablas
+    db_existe = os.path.exists(DB_PATH) and os.path.getsize(DB_PATH) > 0
+
+    with get_db() as conn:
+        cursor = conn.cursor()
+
+        if not db_existe:
+            print("Base de datos no encontrada o vacía. Inicializando...")
+
+            # Verificar si existe el script SQL
+            if os.path.exists(SQL_PATH):
+                print(f"Ejecutando script SQL desde: {SQL_PATH}")
+                sembrar_db(SQL_PATH)
+                print("Base de datos inicializada correctamente desde script SQL.")
+            else:
+                print("Script SQL no encontrado. Se inicializarán las tablas manualmente.")
+                # Crear las tablas manualmente
+                crear_tablas_manualmente(cursor)
+        else:
+            # Comprobar si hay tablas
+            cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
+            tablas = cursor.fetchall()
+            if not tablas:
+                # La base de datos existe pero está vacía
+                if os.path.exists(SQL_PATH):
+                    print(f"Base de datos vacía. Ejecutando script SQL desde: {SQL_PATH}")
+                    sembrar_db(SQL_PATH)
+                    print("Base de datos inicializada correctamente desde script SQL.")
+                else:
+                    print("Script SQL no encontrado. Se inicializarán las tablas manualmente.")
+                    crear_tablas_manualmente(cursor)
+            else:
+                print(f"Base de datos encontrada con {len(tablas)} tablas.")
+
+        aplicar_migraciones(conn)
+
+        pragmas = leer_pragmas(conn, get_perfil_pragmas())
+        print(f"Perfil de PRAGMA '{DB_PRAGMA_PROFILE}': "
+              + ", ".join(f"{nombre}={valor}" for nombre, valor in pragmas.items()))
+
+
+def version_esquema(conn):
+    """
+    Lee la versión del esquema guardada en la cabecera de la base de datos.
+
+    Args:
+        conn (sqlite3.Connection): Conexión a la base de datos
+
+    Returns:
+        int: Valor de PRAGMA user_version (0 si nunca se ha fijado)
+    """
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def comprobar_esquema():
+    """
+    Comprueba que la base de datos tiene el esquema actual y la inicializa si no.
+
+    En el caso habitual (base de datos ya migrada) cuesta una lectura de
+    ``PRAGMA user_version``; solo si falta la base de datos o hay migraciones
+    pendientes se ejecuta inicializar_db().
+
+    Returns:
+        bool: True si ha sido necesario inicializar o migrar la base de datos
+    """
+    if os.path.exists(DB_PATH) and os.path.getsize(DB_PATH) > 0:
+        with get_db() as conn:
+            if version_esquema(conn) >= ESQUEMA_VERSION:
+                return False
+
+    inicializar_db()
+    return True
+
+
+def aplicar_migraciones(conn):
+    """
+    Aplica las migraciones del esquema que aún no se hayan ejecutado.
+
+    Las versiones aplicadas se registran en la tabla ``schema_migraciones``.
+    Cada migración se ejecuta en su propia transacción.
+
+    Args:
+        conn (sqlite3.Connection): Conexión a la base de datos
+
+    Returns:
+        list: Versiones aplicadas en esta llamada
+    """
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS schema_migraciones (
+        version INTEGER PRIMARY KEY,
+        nombre TEXT NOT NULL,
+        fecha_aplicacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    aplicadas = {row[0] for row in conn.execute("SELECT version FROM schema_migraciones")}
+
+    nuevas = []
+    for version, nombre, sentencias in MIGRACIONES:
+        if version in aplicadas:
+            continue
+
+        if conn.in_transaction:
+            conn.commit()
+        conn.execute("BEGIN")
+        try:
+            for sql in sentencias:
+                conn.execute(sql)
+            conn.execute("INSERT INTO schema_migraciones (version, nombre) VALUES (?, ?)",
+                         (version, nombre))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        print(f"Migración {version} aplicada: {nombre}")
+        nuevas.append(version)
+
+    # Guardar la última versión aplicada para que comprobar_esquema() no tenga que
+    # volver a revisar las migraciones en cada arranque
+    ultima = max(aplicadas | set(nuevas), default=0)
+    if version_esquema(conn) != ultima:
+        if conn.in_transaction:
+            conn.commit()
+        conn.execute(f"PRAGMA user_version = {int(ultima)}")
+
+    return nuevas
+
+
+def reconstruir_indices_busqueda():
+    """
+    Reconstruye los índices de búsqueda de texto completo desde sus tablas origen.
+
+    Útil tras cargas masivas hechas sin triggers o si un índice se ha corrompido.
+
+    Returns:
+        list: Nombres de los índices reconstruidos
+    """
+    with get_db() as conn:
+        for indice in INDICES_BUSQUEDA:
+            conn.execute(f"INSERT INTO {indice} ({indice}) VALUES ('rebuild')")
+            conn.execute(f"INSERT INTO {indice} ({indice}) VALUES ('optimize')")
+    return list(INDICES_BUSQUEDA)
+
+
+def reconstruir_resumenes():
+    """
+    Recalcula desde cero las tablas de resumen a partir de los datos originales.
+
+    Returns:
+        dict: Número de filas de cada tabla de resumen reconstruida
+    """
+    filas = {}
+    with get_db() as conn:
+        for tabla, consulta in RESUMENES.items():
+            conn.execute(f"DELETE FROM {tabla}")
+            filas[tabla] = conn.execute(consulta).rowcount
+    return filas
+
+
+def leer_versiones_tablas():
+    """
+    Lee la versión actual de cada tabla versionada.
+
+    Returns:
+        dict: Versión de cada tabla por nombre
+    """
+    with get_db() as conn:
+        cursor = conn.execute("SELECT tabla, version FROM versiones_tablas")
+        return {row['tabla']: row['version'] for row in cursor.fetchall()}
+
+
+# ===================================================================
+# CARGAS MASIVAS
+# ===================================================================
+
+# INSERT de un script SQL: conflicto opcional, tabla, columnas y lista de VALUES
+_IDENTIFICADOR = r'(?:"(?:[^"]|"")+"|`[^`]+`|\[[^\]]+\]|\w+)'
+_PATRON_INSERT = re.compile(
+    rf"INSERT\s+(?:OR\s+(\w+)\s+)?INTO\s+({_IDENTIFICADOR})\s*(?:\(([^)]*)\)\s*)?VALUES\s*(.*?)\s*;?\s*$",
+    re.IGNORECASE | re.DOTALL
+)
+# Sentencias que controlan la transacción o la conexión (p. ej. las de un .dump)
+_PATRON_CONTROL = re.compile(r"(BEGIN|COMMIT|END|ROLLBACK|SAVEPOINT|RELEASE|PRAGMA)\b", re.IGNORECASE)
+_PATRON_COMENTARIOS = re.compile(r"^(?:\s*--[^\n]*(?:\n|$))*")
+
+
+def _leer_sentencias(ruta):
+    """
+    Divide un script SQL en sentencias completas sin cargarlo entero en memoria.
+
+    Args:
+        ruta (str): Ruta del script SQL
+
+    Yields:
+        str: Cada sentencia, sin los comentarios que la preceden
+    """
+    pendiente = []
+    with open(ruta, 'r', encoding='utf-8') as sql_file:
+        for linea in sql_file:
+            pendiente.append(linea)
+            sentencia = ''.join(pendiente)
+            if sqlite3.complete_statement(sentencia):
+                pendiente = []
+                sentencia = _PATRON_COMENTARIOS.sub('', sentencia).strip()
+                if sentencia:
+                    yield sentencia
+
+    resto = _PATRON_COMENTARIOS.sub('', ''.join(pendiente)).strip()
+    if resto:
+        yield resto
+
+
+def _sin_comillas(identificador):
+    """
+    Quita las comillas de un identificador SQL ("x", `x` o [x]).
+
+    Args:
+        identificador (str): Identificador tal como aparece en el script
+
+    Returns:
+        str: Nombre sin comillas
+    """
+    identificador = identificador.strip()
+    if identificador[:1] == '"':
+        return identificador[1:-1].replace('""', '"')
+    if identificador[:1] in ('`', '['):
+        return identificador[1:-1]
+    return identificador
+
+
+def _lotes_sql(ruta, esquema):
+    """
+    Convierte los INSERT de un script SQL en lotes de filas.
+
+    Las tuplas de cada VALUES se evalúan con una conexión SQLite en memoria, así
+    que se interpretan exactamente igual que al ejecutar el script. Se admiten
+    identificadores entre comillas y INSERT sin lista de columnas (como los de
+    un ``.dump``). Las sentencias que no son INSERT (p. ej. CREATE TABLE) se
+    pasan a ``esquema``, salvo BEGIN/COMMIT/SAVEPOINT/PRAGMA, que se omiten
+    porque la carga ya va en su propia transacción.
+
+    Args:
+        ruta (str): Ruta del script SQL
+        esquema (callable): Función que ejecuta las sentencias que no son INSERT
+
+    Yields:
+        tuple: (tabla, columnas, conflicto, filas); columnas es None si el
+            INSERT no las indica
+
+    Raises:
+        ValueError: Si el script contiene un ROLLBACK
+    """
+    evaluador = sqlite3.connect(':memory:')
+    try:
+        for sentencia in _leer_sentencias(ruta):
+            control = _PATRON_CONTROL.match(sentencia)
+            if control:
+                if control.group(1).upper() == 'ROLLBACK':
+                    raise ValueError("El script contiene un ROLLBACK; no se carga nada")
+                continue
+
+            coincidencia = _PATRON_INSERT.match(sentencia)
+            if not coincidencia:
+                esquema(sentencia)
+                continue
+
+            conflicto, tabla, columnas, valores = coincidencia.groups()
+            tabla = _sin_comillas(tabla)
+            if tabla == 'sqlite_sequence':
+                # SQLite actualiza el contador AUTOINCREMENT al insertar las filas
+                continue
+            if columnas is not None:
+                columnas = tuple(_sin_comillas(columna) for columna in columnas.split(','))
+            filas = evaluador.execute("VALUES " + valores).fetchall()
+            yield tabla, columnas, (conflicto or 'ABORT').upper(), filas
+    finally:
+        evaluador.close()
+
+
+def _lotes_archivo(tabla, ruta, formato, conflicto):
+    """
+    Lee un volcado CSV (con cabecera) o JSONL y lo convierte en lotes de filas.
+
+    Args:
+        tabla (str): Tabla de destino
+        ruta (str): Ruta del archivo
+        formato (str): 'csv' o 'jsonl'
+        conflicto (str): Resolución de conflictos del INSERT
+
+    Yields:
+        tuple: (tabla, columnas, conflicto, filas)
+    """
+    with open(ruta, 'r', encoding='utf-8', newline='') as archivo:
+        if formato == 'csv':
+            lector = csv.reader(archivo)
+            columnas = tuple(next(lector, ()))
+            # En CSV las celdas vacías se cargan como NULL
+            registros = (tuple(valor if valor != '' else None for valor in fila)
+                         for fila in lector if fila)
+        else:
+            yield from _lotes_jsonl(tabla, archivo, conflicto)
+            return
+
+        lote = []
+        for registro in registros:
+            lote.append(registro)
+            if len(lote) >= LOTE_CARGA:
+                yield tabla, columnas, conflicto, lote
+                lote = []
+        if lote:
+            yield tabla, columnas, conflicto, lote
+
+
+def _lotes_jsonl(tabla, archivo, conflicto):
+    """
+    Convierte las líneas de un volcado JSONL en lotes de filas.
+
+    Cada lote agrupa líneas consecutivas con las mismas claves; si una línea
+    trae otras claves se empieza un lote nuevo con sus columnas. Así no se
+    pierde ninguna clave y las columnas que faltan toman su valor por defecto.
+
+    Args:
+        tabla (str): Tabla de destino
+        archivo (file): Archivo JSONL abierto
+        conflicto (str): Resolución de conflictos del INSERT
+
+    Yields:
+        tuple: (tabla, columnas, conflicto, filas)
+
+    Raises:
+        ValueError: Si una línea no es un objeto JSON válido
+    """
+    columnas = None
+    claves = None
+    lote = []
+    for numero, linea in enumerate(archivo, 1):
+        if not linea.strip():
+            continue
+        try:
+            objeto = json.loads(linea)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Línea {numero}: JSON no válido ({e.msg})")
+        if not isinstance(objeto, dict):
+            raise ValueError(f"Línea {numero}: se esperaba un objeto JSON")
+
+        if objeto.keys() != claves or len(lote) >= LOTE_CARGA:
+            if lote:
+                yield tabla, columnas, conflicto, lote
+            columnas = tuple(objeto)
+            claves = objeto.keys()
+            lote = []
+        lote.append(tuple(objeto[columna] for columna in columnas))
+    if lote:
+        yield tabla, columnas, conflicto, lote
+
+
+def _diferir_indices_y_triggers(conn, tablas):
+    """
+    Elimina temporalmente los índices y triggers de las tablas que se van a cargar.
+
+    Las restricciones UNIQUE (índices automáticos) se mantienen para que la
+    resolución de conflictos siga funcionando.
+
+    Args:
+        conn (sqlite3.Connection): Conexión en la transacción de carga
+        tablas (set): Tablas de destino
+
+    Returns:
+        list: Pares (nombre, sql) para volver a crearlos
+    """
+    marcadores = ', '.join('?' * len(tablas))
+    objetos = conn.execute(f"""
+        SELECT type, name, sql FROM sqlite_master
+        WHERE type IN ('index', 'trigger') AND sql IS NOT NULL AND tbl_name IN ({marcadores})
+    """, tuple(tablas)).fetchall()
+
+    for tipo, nombre, _ in objetos:
+        conn.execute(f"DROP {'INDEX' if tipo == 'index' else 'TRIGGER'} {nombre}")
+
+    return [(nombre, sql) for _, nombre, sql in objetos]
+
+
+def _guardar_stock_critico_previo(conn, tablas):
+    """
+    Guarda los productos con stock crítico antes de una carga masiva.
+
+    Sin los triggers no se registra qué productos salen del stock crítico, así
+    que ``_reconstruir_derivados`` compara con esta instantánea al terminar.
+
+    Args:
+        conn (sqlite3.Connection): Conexión en la transacción de carga
+        tablas (set): Tablas de destino
+    """
+    existe = conn.execute("""
+        SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'stock_critico_versiones'
+    """).fetchone()
+    if existe and 'productos' in tablas:
+        conn.execute("DROP TABLE IF EXISTS temp.stock_critico_previo")
+        conn.execute("""
+            CREATE TEMP TABLE stock_critico_previo AS
+            SELECT id, nombre, stock_actual, stock_minimo FROM productos
+            WHERE stock_actual <= stock_minimo AND stock_minimo > 0
+        """)
+
+
+def _reconstruir_derivados(conn, tablas):
+    """
+    Recalcula lo que mantienen los triggers diferidos durante una carga masiva.
+
+    En ``stock_critico_versiones`` se versionan, como harían los triggers, los
+    productos que entran en el stock crítico, cambian estando en él o salen de él
+    (también si se han eliminado).
+
+    Args:
+        conn (sqlite3.Connection): Conexión en la transacción de carga
+        tablas (set): Tablas cargadas
+    """
+    existentes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+    for indice, origen in INDICES_BUSQUEDA.items():
+        if indice in existentes and origen in tablas:
+            conn.execute(f"INSERT INTO {indice} ({indice}) VALUES ('rebuild')")
+
+    # Las líneas de venta cargadas sin coste o proveedor los toman como al registrarlas
+    columnas_detalle = {row[1] for row in conn.execute("PRAGMA table_info(ventas_detalle)")}
+    if 'ventas_detalle' in tablas and {'coste_unitario', 'proveedor_id'} <= columnas_detalle:
+        conn.execute(f"""
+            UPDATE ventas_detalle
+            SET coste_unitario = IFNULL(coste_unitario, {sql_coste_venta('ventas_detalle.producto_id',
+                                                                         'ventas_detalle.venta_id')}),
+                proveedor_id = IFNULL(proveedor_id, (SELECT proveedor_id FROM productos
+                                                     WHERE id = ventas_detalle.producto_id))
+            WHERE coste_unitario IS NULL OR proveedor_id IS NULL
+        """)
+
+    if tablas & {'ventas', 'ventas_detalle', 'productos'}:
+        for resumen, consulta in RESUMENES.items():
+            if resumen in existentes:
+                conn.execute(f"DELETE FROM {resumen}")
+                conn.execute(consulta)
+
+    if 'stock_critico_versiones' in existentes and 'productos' in tablas:
+        conn.execute("""
+            WITH actuales AS (
+                SELECT id, nombre, stock_actual, stock_minimo FROM productos
+                WHERE stock_actual <= stock_minimo AND stock_minimo > 0
+            ),
+            cambiados AS (
+                SELECT a.id FROM actuales a
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM temp.stock_critico_previo p
+                    WHERE p.id = a.id AND p.nombre IS a.nombre
+                      AND p.stock_actual IS a.stock_actual AND p.stock_minimo IS a.stock_minimo
+                )
+                UNION
+                SELECT p.id FROM temp.stock_critico_previo p
+                WHERE p.id NOT IN (SELECT id FROM actuales)
+            )
+            INSERT OR REPLACE INTO stock_critico_versiones (producto_id, version)
+            SELECT id, (SELECT IFNULL(MAX(version), 0) + 1 FROM stock_critico_versiones)
+            FROM cambiados
+        """)
+
+    if 'versiones_tablas' in existentes:
+        marcadores = ', '.join('?' * len(tablas))
+        conn.execute(f"UPDATE versiones_tablas SET version = version + 1 WHERE tabla IN ({marcadores})",
+                     tuple(tablas))
+
+
+def _cargar_lotes(lotes):
+    """
+    Carga lotes de filas con executemany en una única transacción.
+
+    Al llegar el primer lote de cada tabla se eliminan sus índices y triggers;
+    al terminar se vuelven a crear y se recalculan los datos derivados
+    (búsqueda, resúmenes y versiones). Así los lotes se leen en una sola pasada
+    sin saber de antemano qué tablas traen.
+
+    Args:
+        lotes (callable): Recibe la función que ejecuta SQL de esquema y
+            devuelve los lotes (tabla, columnas, conflicto, filas). Si las
+            columnas son None se usan todas las de la tabla, en orden
+
+    Returns:
+        dict: Filas cargadas por tabla, segundos empleados y filas por segundo
+    """
+    inicio = time.perf_counter()
+    filas = {}
+
+    with get_db() as conn:
+        if conn.in_transaction:
+            conn.commit()
+        conn.execute("BEGIN")
+        try:
+            diferidos = []
+            columnas_validas = {}
+
+            for tabla, columnas, conflicto, lote in lotes(conn.execute):
+                if tabla not in TABLAS_CARGA:
+                    raise ValueError(f"No se pueden cargar datos en la tabla {tabla}")
+                if tabla not in columnas_validas:
+                    columnas_validas[tabla] = tuple(row[1] for row in conn.execute(f"PRAGMA table_info({tabla})"))
+                    if not columnas_validas[tabla]:
+                        raise ValueError(f"La tabla {tabla} no existe")
+                    _guardar_stock_critico_previo(conn, {tabla})
+                    diferidos.extend(_diferir_indices_y_triggers(conn, {tabla}))
+                if columnas is None:
+                    columnas = columnas_validas[tabla]
+                desconocidas = set(columnas) - set(columnas_validas[tabla])
+                if desconocidas:
+                    raise ValueError(f"Columnas desconocidas en {tabla}: {', '.join(sorted(desconocidas))}")
+                if conflicto not in ('ABORT', 'IGNORE', 'REPLACE', 'FAIL', 'ROLLBACK'):
+                    raise ValueError(f"Resolución de conflictos no válida: {conflicto}")
+
+                conn.executemany(
+                    f"INSERT OR {conflicto} INTO {tabla} ({', '.join(columnas)}) "
+                    f"VALUES ({', '.join('?' * len(columnas))})",
+                    lote
+                )
+                filas[tabla] = filas.get(tabla, 0) + len(lote)
+
+            for nombre, sql in diferidos:
+                # El propio script puede haberlos vuelto a crear después de la carga
+                if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (nombre,)).fetchone():
+                    conn.execute(sql)
+            if filas:
+                _reconstruir_derivados(conn, set(filas))
+            conn.execute("DROP TABLE IF EXISTS temp.stock_critico_previo")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    segundos = time.perf_counter() - inicio
+    total = sum(filas.values())
+    return {
+        'filas': filas,
+        'segundos': round(segundos, 3),
+        'filas_por_segundo': round(total / segundos) if segundos > 0 else total
+    }
+
+
+def sembrar_db(ruta=SQL_PATH):
+    """
+    Carga un script SQL de datos iniciales mediante inserciones por lotes.
+
+    Las sentencias de esquema se ejecutan tal cual y los INSERT se agrupan por
+    tabla y columnas y se insertan con executemany, todo en una transacción.
+    Es mucho más rápido que ``executescript`` con un INSERT por fila. El script
+    se lee una sola vez y admite la salida de ``.dump``: sus BEGIN/COMMIT y
+    PRAGMA se omiten.
+
+    Args:
+        ruta (str): Ruta del script SQL (por defecto el de la aplicación)
+
+    Returns:
+        dict: Filas cargadas por tabla, segundos empleados y filas por segundo
+    """
+    def lotes(ejecutar):
+        pendiente = None
+        for tabla, columnas, conflicto, filas in _lotes_sql(ruta, ejecutar):
+            clave = (tabla, columnas, conflicto)
+            if pendiente and (pendiente[0] != clave or len(pendiente[1]) >= LOTE_CARGA):
+                yield (*pendiente[0], pendiente[1])
+                pendiente = None
+            if pendiente is None:
+                pendiente = (clave, [])
+            pendiente[1].extend(filas)
+        if pendiente:
+            yield (*pendiente[0], pendiente[1])
+
+    return _cargar_lotes(lotes)
+
+
+def importar_datos(tabla, ruta, formato=None, conflicto='ABORT'):
+    """
+    Carga un volcado CSV o JSONL en una tabla mediante inserciones por lotes.
+
+    En CSV la primera fila indica las columnas; en JSONL cada línea es un objeto
+    con las columnas como claves (las que falten en una línea toman su valor
+    por defecto).
+
+    Args:
+        tabla (str): Tabla de destino
+        ruta (str): Ruta del archivo
+        formato (str, optional): 'csv' o 'jsonl' (por defecto, según la extensión)
+        conflicto (str): Resolución de conflictos: ABORT, IGNORE o REPLACE
+
+    Returns:
+        dict: Filas cargadas por tabla, segundos empleados y filas por segundo
+
+    Raises:
+        ValueError: Si el formato, la tabla o las columnas no son válidos
+    """
+    formato = (formato or os.path.splitext(ruta)[1].lstrip('.')).lower()
+    if formato == 'json':
+        formato = 'jsonl'
+    if formato not in ('csv', 'jsonl'):
+        raise ValueError(f"Formato no soportado: {formato}")
+    if tabla not in TABLAS_CARGA:
+        raise ValueError(f"No se pueden cargar datos en la tabla {tabla}")
+
+    return _cargar_lotes(lambda ejecutar: _lotes_archivo(tabla, ruta, formato, conflicto.upper()))
+
+
+def crear_tablas_manualmente(cursor):
+    """
+    Crea las tablas de la base de datos manualmente.
+
+    Args:
+        cursor: Cursor de la conexión a la base de datos
+    """
+    # Crear tabla de usuarios
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS usuarios (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            email TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            es_admin BOOLEAN DEFAULT 0,
+            fecha_registro TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Crear tabla de proveedores
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS proveedores (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        nombre TEXT NOT NULL,
+        cif TEXT UNIQUE NOT NULL,
+        direccion TEXT,
+        telefono TEXT,
+        email TEXT,
+        porcentaje_descuento REAL DEFAULT 0,
+        iva REAL DEFAULT 21,
+        notas TEXT
+    )
+    ''')
+
+    # Crear tabla de productos
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS productos (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        nombre TEXT NOT NULL,
+        referencia TEXT UNIQUE NOT NULL,
+        descripcion TEXT,
+        precio_compra REAL NOT NULL,
+        precio_venta REAL NOT NULL,
+        stock_actual INTEGER DEFAULT 0,
+        stock_minimo INTEGER DEFAULT 0,
+        ubicacion_almacen TEXT,
+        categoria TEXT,
+        imagen TEXT,
+        proveedor_id INTEGER,
+        FOREIGN KEY (proveedor_id) REFERENCES proveedores (id)
+    )
+    ''')
+
+    # Crear tabla de ventas (pedidos de clientes)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS ventas (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        cliente_id INTEGER NOT NULL,
+        fecha TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        total REAL DEFAULT 0,
+        FOREIGN KEY (cliente_id) REFERENCES usuarios (id)
+    )
+    ''')
+
+    # Crear tabla de detalle de ventas
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS ventas_detalle (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        venta_id INTEGER NOT NULL,
+        producto_id INTEGER NOT NULL,
+        cantidad INTEGER NOT NULL,
+        precio_unitario REAL NOT NULL,
+        FOREIGN KEY (venta_id) REFERENCES ventas (id),
+        FOREIGN KEY (producto_id) REFERENCES productos (id)
+    )
+    ''')
+
+    # Crear tabla de compras (a proveedores)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS compras (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        proveedor_id INTEGER NOT NULL,
+        fecha TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        total REAL DEFAULT 0,
+        FOREIGN KEY (proveedor_id) REFERENCES proveedores (id)
+    )
+    ''')
+
+    # Crear tabla de detalle de compras
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS compras_detalle (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        compra_id INTEGER NOT NULL,
+        producto_id INTEGER NOT NULL,
+        cantidad INTEGER NOT NULL,
+        precio_unitario REAL NOT NULL,
+        FOREIGN KEY (compra_id) REFERENCES compras (id),
+        FOREIGN KEY (producto_id) REFERENCES productos (id)
+    )
+    ''')
+
     print("Base de datos inicializada manualmente correctamente.")
\ No newline at end of file
@@ -6,11 +6,21 @@ para la gestión de la tienda de componentes informáticos.
 
 """
 
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, g
 from models import Usuario, Proveedor, Producto, Venta, VentaDetalle, Compra, CompraDetalle, Estadisticas
-from db import inicializar_db, get_db
+from db import (inicializar_db, comprobar_esquema, get_db, UnidadDeTrabajo,
+                reconstruir_indices_busqueda, reconstruir_resumenes, leer_versiones_tablas,
+                sembrar_db, importar_datos, SQL_PATH)
+import cache
+import seguridad
+import click
 import os
 import datetime
+import functools
+import hashlib
+import threading
+import csv
+import io
 from werkzeug.utils import secure_filename
 import json
 
@@ -18,20 +28,199 @@ import json
 # CONFIGURACIÓN DE LA APLICACIÓN
 # ===================================================================
 
-# Inicializar la base de datos
-inicializar_db()
-
 # Configuración de la aplicación Flask
 app = Flask(__name__)
 app.secret_key = 'clave_secreta_store_componentes'  # Cambiar en producción
 app.config['UPLOAD_FOLDER'] = os.path.join('static', 'uploads')
 app.config['MAX_CONTENT_LENGTH'] = 2 * 1024 * 1024  # 2MB máximo
+app.config['PRODUCTOS_POR_PAGINA'] = 24
+app.config['VENTAS_POR_PAGINA'] = 50
+app.config['USUARIOS_POR_PAGINA'] = 50
+app.config['API_MAX_POR_PAGINA'] = 200
+app.config['API_CACHE_TTL'] = 300  # Segundos que se guardan las respuestas JSON en memoria
+app.config['API_CACHE_MAX_ENTRADAS'] = 512
+app.config['DASHBOARD_PARALELO'] = False  # Calcular el panel de estadísticas en varios hilos
+app.config['EXPORTACION_TAMANO_BLOQUE'] = 64 * 1024  # Bytes aproximados de cada bloque exportado
+app.config['IMPORTACION_MAX_BYTES'] = 64 * 1024 * 1024  # Tamaño máximo de un catálogo importado
 
 # Asegurar que existe el directorio de uploads
 if not os.path.exists(app.config['UPLOAD_FOLDER']):
     os.makedirs(app.config['UPLOAD_FOLDER'])
 
 
+# ===================================================================
+# ARRANQUE DE LA APLICACIÓN
+# ===================================================================
+
+# La comprobación del esquema se hace una sola vez por proceso, no al importar
+_app_iniciada = False
+_arranque_lock = threading.Lock()
+
+
+def iniciar_app():
+    """
+    Fase de arranque: comprueba (y si hace falta inicializa) la base de datos.
+
+    Con la base de datos ya migrada solo cuesta leer PRAGMA user_version. Es
+    idempotente y segura entre hilos; se ejecuta como mucho una vez por proceso.
+    """
+    global _app_iniciada
+    if _app_iniciada:
+        return
+    with _arranque_lock:
+        if not _app_iniciada:
+            comprobar_esquema()
+            _app_iniciada = True
+
+
+def create_app():
+    """
+    Fábrica de la aplicación para servidores WSGI (p. ej. ``gunicorn 'main:create_app()'``).
+
+    Returns:
+        Flask: Aplicación con la base de datos ya comprobada
+    """
+    iniciar_app()
+    return app
+
+
+@app.before_request
+def asegurar_arranque():
+    """Completa el arranque en la primera petición si no se usó create_app()."""
+    if not _app_iniciada:
+        iniciar_app()
+
+
+# ===================================================================
+# TRANSACCIÓN POR PETICIÓN
+# ===================================================================
+
+@app.before_request
+def abrir_unidad_trabajo():
+    """
+    Abre una transacción compartida por todas las consultas de la petición.
+
+    También descarta las cachés en memoria que otro proceso haya dejado obsoletas.
+    """
+    if request.endpoint != 'static':
+        g.unidad_trabajo = UnidadDeTrabajo()
+        g.versiones_tablas = leer_versiones_tablas()
+        cache.sincronizar_versiones(g.versiones_tablas)
+        cargar_usuario_actual()
+
+
+def cargar_usuario_actual():
+    """
+    Carga en ``g.current_user`` el usuario de la sesión.
+
+    El usuario se obtiene de la caché en memoria, así que las peticiones repetidas
+    de un mismo usuario no consultan la base de datos. Si el usuario ya no existe
+    se cierra la sesión, y si ha cambiado su rol se actualiza la sesión.
+    """
+    g.current_user = None
+    usuario_id = session.get('usuario_id')
+    if usuario_id is None:
+        return
+
+    usuario = Usuario.get_cacheado(usuario_id)
+    if usuario is None:
+        session.clear()
+        return
+
+    if session.get('es_admin') != usuario.es_admin:
+        session['es_admin'] = usuario.es_admin
+    g.current_user = usuario
+
+
+@app.after_request
+def confirmar_unidad_trabajo(response):
+    """Confirma la transacción de la petición antes de enviar la respuesta."""
+    unidad_trabajo = g.get('unidad_trabajo')
+    if unidad_trabajo is not None:
+        unidad_trabajo.confirmar()
+    return response
+
+
+@app.teardown_request
+def cerrar_unidad_trabajo(error=None):
+    """Devuelve la conexión al pool, deshaciendo lo que no se haya confirmado."""
+    unidad_trabajo = g.pop('unidad_trabajo', None)
+    if unidad_trabajo is not None:
+        unidad_trabajo.cerrar(error)
+
+
+# ===================================================================
+# CACHÉ DE RESPUESTAS DE LA API
+# ===================================================================
+
+_respuestas_api = cache.get_cache('respuestas.api', app.config['API_CACHE_TTL'],
+                                  app.config['API_CACHE_MAX_ENTRADAS'])
+
+
+def respuesta_cacheada(*tablas):
+    """
+    Decorador que cachea una respuesta JSON y la valida con un ETag.
+
+    La respuesta se guarda por ruta, parámetros de consulta y usuario/rol. Su ETag
+    se deriva de la versión de las tablas de las que depende (y del día actual,
+    porque las estadísticas usan ventanas de días), así que si el cliente envía
+    If-None-Match con el ETag vigente se responde 304 sin ejecutar la vista.
+
+    Args:
+        *tablas (str): Tablas cuyos cambios invalidan la respuesta
+
+    Returns:
+        function: Decorador
+    """
+    def decorador(vista):
+        @functools.wraps(vista)
+        def envoltura(*args, **kwargs):
+            versiones = g.get('versiones_tablas')
+            if versiones is None:
+                versiones = leer_versiones_tablas()
+
+            clave = (request.path, tuple(sorted(request.args.items(multi=True))),
+                     session.get('usuario_id'), bool(session.get('es_admin')))
+            firma = json.dumps([clave, [versiones.get(tabla, 0) for tabla in tablas],
+                                datetime.datetime.now(datetime.timezone.utc).date().isoformat()])
+            etag = hashlib.sha256(firma.encode('utf-8')).hexdigest()
+
+            if request.if_none_match.contains(etag):
+                response = app.response_class(status=304)
+            else:
+                guardada = _respuestas_api.obtener(clave, None)
+                if guardada is not None and guardada[0] == etag:
+                    response = app.response_class(guardada[1], status=200, headers=guardada[2])
+                else:
+                    response = app.make_response(vista(*args, **kwargs))
+                    if response.status_code != 200:
+                        return response
+                    response.set_etag(etag)
+                    _respuestas_api.guardar(clave, (etag, response.get_data(),
+                                                    list(response.headers.items())))
+
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            response.vary.add('Cookie')
+            return response
+
+        return envoltura
+
+    return decorador
+
+
+@app.errorhandler(seguridad.HashSaturado)
+def hash_saturado(error):
+    """Responde a una avalancha de operaciones de contraseña sin bloquear el worker."""
+    unidad_trabajo = g.get('unidad_trabajo')
+    if unidad_trabajo is not None:
+        unidad_trabajo.revertir()
+    flash('Hay demasiadas solicitudes en este momento. Inténtalo de nuevo en unos segundos.', 'warning')
+    response = redirect(request.referrer or url_for('home'))
+    response.headers['Retry-After'] = '5'
+    return response
+
+
 # ===================================================================
 # FILTROS TEMPLATE Y CONTEXTO GLOBAL
 # ===================================================================
@@ -85,6 +274,11 @@ def login():
         usuario = Usuario.get_by_username(username)
 
         if usuario and Usuario.verify_password(usuario.password, password):
+            # Regenerar el hash si se creó con otros parámetros de coste
+            if Usuario.necesita_rehash(usuario.password):
+                usuario.password = Usuario.hash_password(password)
+                usuario.save()
+
             # Guardar información del usuario en la sesión
             session['usuario_id'] = usuario.id
             session['username'] = usuario.username
@@ -166,13 +360,20 @@ def gestionar_usuarios():
         return redirect(url_for('home'))
 
     busqueda = request.args.get('busqueda', '').strip()
+    pagina = None
 
     if busqueda:
-        usuarios = Usuario.buscar(busqueda)
+        antes = request.args.get('antes')
+        pagina = Usuario.buscar_pagina(busqueda,
+                                       por_pagina=app.config['USUARIOS_POR_PAGINA'],
+                                       cursor=antes or request.args.get('despues'),
+                                       retroceder=bool(antes))
+        usuarios = pagina.elementos
     else:
         usuarios = []
 
-    return render_template('usuarios/usuarios_listar.html', usuarios=usuarios, busqueda=busqueda)
+    return render_template('usuarios/usuarios_listar.html', usuarios=usuarios, pagina=pagina,
+                           busqueda=busqueda)
 
 
 @app.route('/usuarios/<int:usuario_id>/editar', methods=['GET', 'POST'])
@@ -221,7 +422,7 @@ def eliminar_usuario(usuario_id):
 
     admin_password = request.form.get('admin_password')
 
-    admin = Usuario.get_by_id(session['usuario_id'])
+    admin = g.current_user
     if not admin or not Usuario.verify_password(admin.password, admin_password):
         flash('Contraseña de administrador incorrecta', 'danger')
         return redirect(url_for('gestionar_usuarios'))
@@ -266,15 +467,21 @@ def listar_productos():
     """
     busqueda = request.args.get('busqueda', '')
     categoria_actual = request.args.get('categoria', '')
+    antes = request.args.get('antes')
 
-    # Obtener productos con filtros aplicados
-    productos = Producto.get_all(busqueda=busqueda, categoria=categoria_actual)
+    # Obtener la página de productos con filtros aplicados
+    pagina = Producto.get_pagina(busqueda=busqueda,
+                                 categoria=categoria_actual,
+                                 por_pagina=app.config['PRODUCTOS_POR_PAGINA'],
+                                 cursor=antes or request.args.get('despues'),
+                                 retroceder=bool(antes))
 
     # Obtener todas las categorías para el filtro
     categorias = Producto.get_categorias()
 
     return render_template('productos/productos_listar.html',
-                           productos=productos,
+                           productos=pagina.elementos,
+                           pagina=pagina,
                            busqueda=busqueda,
                            categoria_actual=categoria_actual,
                            categorias=categorias)
@@ -476,7 +683,7 @@ def api_productos_por_proveedor():
     if not proveedor_id:
         return jsonify([])
 
-    productos = Producto.get_by_proveedor(proveedor_id)
+    productos = Producto.get_by_proveedor(proveedor_id, ligero=True)
     return jsonify([{
         'id': p.id,
         'nombre': p.nombre,
@@ -674,14 +881,25 @@ def listar_ventas():
         # Ajustar hasta al final del día
         hasta = hasta.replace(hour=23, minute=59, second=59)
 
-    # Obtener ventas según rol del usuario
-    if session.get('es_admin'):
-        ventas = Venta.get_all(desde=desde, hasta=hasta)
-    else:
-        # Si es cliente normal, solo sus ventas
-        ventas = Venta.get_by_cliente(session['usuario_id'], desde=desde, hasta=hasta)
+    antes = request.args.get('antes')
+    # El total exige un COUNT(*) sobre todo el historial filtrado: solo si se pide
+    con_total = request.args.get('total') == '1'
+
+    # Obtener ventas según rol del usuario (el cliente normal, solo sus ventas)
+    pagina = Venta.get_pagina(cliente_id=None if session.get('es_admin') else session['usuario_id'],
+                              desde=desde,
+                              hasta=hasta,
+                              por_pagina=app.config['VENTAS_POR_PAGINA'],
+                              cursor=antes or request.args.get('despues'),
+                              retroceder=bool(antes),
+                              con_total=con_total)
 
-    return render_template('ventas/ventas_listar.html', ventas=ventas)
+    return render_template('ventas/ventas_listar.html',
+                           ventas=pagina.elementos,
+                           pagina=pagina,
+                           fecha_desde=desde_str,
+                           fecha_hasta=hasta_str,
+                           total='1' if con_total else None)
 
 
 @app.route('/ventas/<int:venta_id>')
@@ -746,50 +964,22 @@ def crear_venta():
                 flash('El carrito está vacío', 'warning')
                 return redirect(url_for('crear_venta'))
 
-            # Calcular total
-            total = 0
-            for item in carrito:
-                total += float(item['precio']) * int(item['cantidad'])
-
-            # Crear la venta
-            nueva_venta = Venta(
-                cliente_id=session['usuario_id'],
-                total=total
-            )
-
-            nueva_venta.save()
-
-            # Crear los detalles de la venta
-            for item in carrito:
-                producto_id = int(item['id'])
-                cantidad = int(item['cantidad'])
-                precio = float(item['precio'])
-
-                # Verificar stock
-                producto = Producto.get_by_id(producto_id)
-                if not producto:
-                    continue
-
-                if producto.stock_actual < cantidad:
-                    # Si no hay suficiente stock, ajustar cantidad
-                    cantidad = producto.stock_actual
-                    if cantidad <= 0:
-                        continue
-
-                # Crear detalle
-                detalle = VentaDetalle(
-                    venta_id=nueva_venta.id,
-                    producto_id=producto_id,
-                    cantidad=cantidad,
-                    precio_unitario=precio
-                )
-
-                detalle.save()
+            lineas = [(int(item['id']), int(item['cantidad']), float(item['precio']))
+                      for item in carrito]
+
+            # Crear la venta con todas sus líneas y descontar el stock
+            nueva_venta, recortadas = Venta.crear_con_detalles(session['usuario_id'], lineas)
+
+            if recortadas:
+                flash('Algunos productos no tenían stock suficiente y se ha ajustado la cantidad',
+                      'warning')
 
             flash('Compra realizada correctamente', 'success')
             return redirect(url_for('ver_venta', venta_id=nueva_venta.id))
 
         except Exception as e:
+            # Deshacer la venta completa, incluidas las líneas ya registradas
+            g.unidad_trabajo.revertir()
             flash(f'Error al procesar la compra: {str(e)}', 'danger')
             return redirect(url_for('crear_venta'))
 
@@ -902,44 +1092,21 @@ def crear_compra():
                                        proveedores=proveedores,
                                        productos=productos)
 
-            # Calcular total
-            total = 0
-            for item in productos_lista:
-                total += float(item['precio']) * int(item['cantidad'])
-
-            # Crear la compra
-            nueva_compra = Compra(
-                proveedor_id=proveedor_id,
-                total=total
-            )
-
-            nueva_compra.save()
-
-            # Crear los detalles de la compra
-            for item in productos_lista:
-                producto_id = int(item['id'])
-                cantidad = int(item['cantidad'])
-                precio = float(item['precio'])
+            lineas = [(int(item['id']), int(item['cantidad']), float(item['precio']))
+                      for item in productos_lista]
 
-                # Verificar que el producto existe
-                producto = Producto.get_by_id(producto_id)
-                if not producto:
-                    continue
+            # Registrar la compra con todas sus líneas e incrementar el stock
+            nueva_compra, omitidos = Compra.crear_con_detalles(proveedor_id, lineas)
 
-                # Crear detalle
-                detalle = CompraDetalle(
-                    compra_id=nueva_compra.id,
-                    producto_id=producto_id,
-                    cantidad=cantidad,
-                    precio_unitario=precio
-                )
-
-                detalle.save()
+            if omitidos:
+                flash(f'Se han omitido {len(omitidos)} productos que no existen', 'warning')
 
             flash('Compra registrada correctamente', 'success')
             return redirect(url_for('ver_compra', compra_id=nueva_compra.id))
 
         except Exception as e:
+            # Deshacer la compra completa, incluidas las líneas ya registradas
+            g.unidad_trabajo.revertir()
             flash(f'Error al procesar la compra: {str(e)}', 'danger')
             return render_template('compras/compras_crear.html',
                                    proveedores=proveedores,
@@ -972,6 +1139,7 @@ def estadisticas():
 
 
 @app.route('/api/estadisticas/ventas-mensuales')
+@respuesta_cacheada('ventas')
 def api_ventas_mensuales():
     """API para obtener datos de ventas mensuales."""
     # Verificar si el usuario está autenticado
@@ -990,6 +1158,7 @@ def api_ventas_mensuales():
 
 
 @app.route('/api/estadisticas/productos-mas-vendidos')
+@respuesta_cacheada('ventas', 'ventas_detalle', 'productos')
 def api_productos_mas_vendidos():
     """API para obtener datos de productos más vendidos."""
     # Verificar si el usuario está autenticado
@@ -1008,6 +1177,7 @@ def api_productos_mas_vendidos():
 
 
 @app.route('/api/estadisticas/beneficios-por-proveedor')
+@respuesta_cacheada('ventas', 'ventas_detalle', 'productos', 'proveedores')
 def api_beneficios_por_proveedor():
     """API para obtener datos de beneficios por proveedor."""
     # Verificar si el usuario es administrador
@@ -1022,65 +1192,405 @@ def api_beneficios_por_proveedor():
 
 
 @app.route('/api/estadisticas/stock-critico')
+@respuesta_cacheada('productos')
 def api_stock_critico():
-    """API para obtener datos de productos con stock crítico."""
+    """
+    API para obtener datos de productos con stock crítico.
+
+    La versión del listado se envía en la cabecera X-Stock-Critico-Version; con el
+    parámetro ``desde`` se obtienen solo los cambios posteriores a esa versión.
+    """
     # Verificar si el usuario es administrador
     if not session.get('es_admin'):
         return jsonify([])
 
+    # Con ?desde=N solo se devuelven los cambios posteriores a la versión N
+    desde = request.args.get('desde', type=int)
+    if desde is not None:
+        return jsonify(Estadisticas.stock_critico_desde(desde))
+
     datos = Estadisticas.stock_critico()
 
-    return jsonify(datos)
+    response = jsonify(datos)
+    response.headers['X-Stock-Critico-Version'] = str(Estadisticas.version_stock_critico())
+    return response
 
 
 @app.route('/api/ventas')
+@respuesta_cacheada('ventas')
 def api_ventas():
     """API para obtener datos de ventas del usuario."""
     # Verificar si el usuario está autenticado
     if not session.get('usuario_id'):
-        return jsonify([])
+        return jsonify({'ventas': [], 'siguiente': None, 'anterior': None, 'total': 0})
+
+    por_pagina = min(request.args.get('por_pagina', app.config['VENTAS_POR_PAGINA'], type=int),
+                     app.config['API_MAX_POR_PAGINA'])
+    antes = request.args.get('antes')
 
     # Obtener ventas según rol del usuario
-    if session.get('es_admin'):
-        ventas = Venta.get_all()
-    else:
-        ventas = Venta.get_by_cliente(session['usuario_id'])
+    pagina = Venta.get_pagina(cliente_id=None if session.get('es_admin') else session['usuario_id'],
+                              por_pagina=max(por_pagina, 1),
+                              cursor=antes or request.args.get('despues'),
+                              retroceder=bool(antes),
+                              con_total=request.args.get('total') == '1')
 
     # Convertir a formato JSON simple
     datos = []
-    for venta in ventas:
+    for venta in pagina:
         datos.append({
             'id': venta.id,
             'fecha': venta.fecha.strftime('%d/%m/%Y %H:%M'),
             'total': f"{venta.total:.2f} €"
         })
 
-    return jsonify(datos)
+    return jsonify({
+        'ventas': datos,
+        'siguiente': pagina.siguiente,
+        'anterior': pagina.anterior,
+        'total': pagina.total
+    })
 
 
 @app.route('/api/estadisticas/clientes')
+@respuesta_cacheada('ventas')
 def api_estadisticas_clientes():
     """API para obtener estadísticas de clientes activos."""
     if not session.get('usuario_id') or not session.get('es_admin'):
         return jsonify({'total': 0})
 
-    with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT COUNT(DISTINCT cliente_id)
-            FROM ventas
-            WHERE cliente_id IS NOT NULL
-        """)
-        total = cursor.fetchone()[0]
-        return jsonify({'total': total})
+    return jsonify({'total': Estadisticas.clientes_activos()})
+
+
+@app.route('/api/estadisticas/dashboard')
+@respuesta_cacheada('ventas', 'ventas_detalle', 'productos', 'proveedores')
+def api_estadisticas_dashboard():
+    """
+    API con todos los bloques del panel de estadísticas en una sola petición.
+
+    Con DASHBOARD_PARALELO en la configuración las consultas se ejecutan en
+    paralelo en un pool de hilos; no se puede activar desde la petición.
+    """
+    if not session.get('usuario_id') or not session.get('es_admin'):
+        return jsonify({})
+
+    dias = request.args.get('dias', 30, type=int)
+
+    return jsonify(Estadisticas.dashboard(dias=dias, paralelo=app.config['DASHBOARD_PARALELO']))
+
+
+@app.route('/api/admin/metricas')
+def api_metricas():
+    """API con las métricas de las cachés y del pool de hashing de este proceso."""
+    if not session.get('es_admin'):
+        return jsonify({})
+
+    return jsonify({
+        'pid': os.getpid(),
+        'cache': cache.estadisticas(),
+        'hash': seguridad.ejecutor_hash.estadisticas()
+    })
+
+
+# ===================================================================
+# EXPORTACIÓN DE DATOS
+# ===================================================================
+
+# Generador de filas y filtros admitidos por cada exportación
+EXPORTACIONES = {
+    'ventas': (Venta.exportar, ('desde', 'hasta', 'cliente_id', 'proveedor_id')),
+    'compras': (Compra.exportar, ('desde', 'hasta', 'proveedor_id')),
+    'productos': (Producto.exportar, ('proveedor_id', 'categoria')),
+}
+
+FORMATOS_EXPORTACION = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+
+
+def _en_bloques(lineas, tamano):
+    """Agrupa las líneas de texto en bloques de unos ``tamano`` caracteres."""
+    bloque, longitud = [], 0
+    for linea in lineas:
+        bloque.append(linea)
+        longitud += len(linea)
+        if longitud >= tamano:
+            yield ''.join(bloque)
+            bloque, longitud = [], 0
+    if bloque:
+        yield ''.join(bloque)
+
+
+def _lineas_csv(filas):
+    """Convierte filas (diccionarios) en líneas CSV, con cabecera."""
+    buffer = io.StringIO()
+    escritor = None
+    for fila in filas:
+        if escritor is None:
+            escritor = csv.DictWriter(buffer, fieldnames=list(fila))
+            escritor.writeheader()
+        escritor.writerow(fila)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def _lineas_jsonl(filas):
+    """Convierte filas (diccionarios) en líneas JSON."""
+    for fila in filas:
+        yield json.dumps(fila, ensure_ascii=False) + '\n'
+
+
+def exportar_datos(entidad, formato='csv', **filtros):
+    """
+    Genera una exportación por bloques de texto, sin cargarla entera en memoria.
+
+    Args:
+        entidad (str): 'ventas', 'compras' o 'productos'
+        formato (str): 'csv' o 'jsonl'
+        **filtros: Filtros admitidos por la entidad (los vacíos se ignoran)
+
+    Returns:
+        generator: Bloques de texto de la exportación
+
+    Raises:
+        ValueError: Si la entidad, el formato o alguna fecha no son válidos
+    """
+    if entidad not in EXPORTACIONES:
+        raise ValueError(f"Exportación desconocida: {entidad}")
+    if formato not in FORMATOS_EXPORTACION:
+        raise ValueError(f"Formato no soportado: {formato}")
+
+    generador, admitidos = EXPORTACIONES[entidad]
+    argumentos = {nombre: valor for nombre, valor in filtros.items()
+                  if nombre in admitidos and valor not in (None, '')}
+    for nombre in ('desde', 'hasta'):
+        if nombre in argumentos:
+            try:
+                argumentos[nombre] = datetime.date.fromisoformat(str(argumentos[nombre]))
+            except ValueError:
+                raise ValueError(f"Fecha no válida en '{nombre}': {argumentos[nombre]}")
+
+    filas = generador(**argumentos)
+    lineas = _lineas_csv(filas) if formato == 'csv' else _lineas_jsonl(filas)
+    return _en_bloques(lineas, app.config['EXPORTACION_TAMANO_BLOQUE'])
+
+
+@app.route('/exportar/<entidad>')
+def exportar(entidad):
+    """
+    Descarga ventas, compras o productos en CSV o JSONL.
+
+    La respuesta se envía por bloques (transfer-encoding chunked) a medida que se
+    leen las filas. Los clientes solo pueden exportar sus propias ventas.
+    """
+    if not session.get('usuario_id'):
+        flash('Debes iniciar sesión para exportar datos', 'warning')
+        return redirect(url_for('login'))
+
+    filtros = {
+        'desde': request.args.get('desde'),
+        'hasta': request.args.get('hasta'),
+        'cliente_id': request.args.get('cliente_id', type=int),
+        'proveedor_id': request.args.get('proveedor_id', type=int),
+        'categoria': request.args.get('categoria'),
+    }
+    if not session.get('es_admin'):
+        if entidad != 'ventas':
+            flash('No tienes permisos para acceder a esta página', 'danger')
+            return redirect(url_for('home'))
+        filtros['cliente_id'] = session['usuario_id']
+
+    formato = request.args.get('formato', 'csv')
+    try:
+        bloques = exportar_datos(entidad, formato, **filtros)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    response = app.response_class(bloques, mimetype=FORMATOS_EXPORTACION[formato])
+    response.headers['Content-Disposition'] = f'attachment; filename={entidad}.{formato}'
+    return response
+
+
+# ===================================================================
+# IMPORTACIÓN DE CATÁLOGOS
+# ===================================================================
+
+def leer_registros(archivo, formato):
+    """
+    Lee registros de un archivo de texto CSV (con cabecera) o JSONL, uno a uno.
+
+    Args:
+        archivo (file): Archivo de texto abierto
+        formato (str): 'csv' o 'jsonl'
+
+    Yields:
+        dict: Cada registro (None si una línea JSONL no es JSON válido)
+    """
+    if formato == 'csv':
+        yield from csv.DictReader(archivo)
+        return
+
+    for linea in archivo:
+        if not linea.strip():
+            continue
+        try:
+            yield json.loads(linea)
+        except ValueError:
+            yield None
+
+
+@app.route('/api/productos/importar', methods=['POST'])
+def api_importar_productos():
+    """
+    API para importar un catálogo de productos (CSV o JSONL) con upsert por referencia.
+
+    El archivo se envía en el campo ``archivo`` de un formulario multipart o
+    directamente como cuerpo de la petición; el formato se toma de ``?formato=``,
+    de la extensión del archivo o del tipo de contenido.
+    """
+    if not session.get('es_admin'):
+        return jsonify({'error': 'No tienes permisos para importar productos'}), 403
+
+    # Los catálogos de proveedores superan el límite general de subida
+    request.max_content_length = app.config['IMPORTACION_MAX_BYTES']
+
+    archivo = request.files.get('archivo')
+    if archivo:
+        flujo, nombre, tipo = archivo.stream, archivo.filename or '', archivo.mimetype
+    else:
+        flujo, nombre, tipo = request.stream, '', request.mimetype
+
+    formato = request.args.get('formato')
+    if not formato:
+        if nombre.lower().endswith('.csv') or tipo == 'text/csv':
+            formato = 'csv'
+        elif nombre.lower().endswith(('.jsonl', '.json')) or 'json' in (tipo or ''):
+            formato = 'jsonl'
+    if formato not in ('csv', 'jsonl'):
+        return jsonify({'error': 'Indica el formato del catálogo (csv o jsonl)'}), 400
+
+    # Cada lote se confirma en su propia transacción (véase Producto.importar_catalogo)
+    texto = io.TextIOWrapper(flujo, encoding='utf-8-sig', newline='')
+    try:
+        resultado = Producto.importar_catalogo(leer_registros(texto, formato))
+    except (UnicodeDecodeError, csv.Error, json.JSONDecodeError, ValueError) as e:
+        g.unidad_trabajo.revertir()
+        return jsonify({'error': f'El catálogo no se puede leer: {str(e)}. '
+                                 'Los lotes anteriores al error ya se han guardado.'}), 400
+    except Exception as e:
+        g.unidad_trabajo.revertir()
+        return jsonify({'error': f'Error al importar el catálogo: {str(e)}'}), 500
+    finally:
+        texto.detach()
+
+    return jsonify(resultado)
+
+
+# ===================================================================
+# COMANDOS DE ADMINISTRACIÓN
+# ===================================================================
+
+@app.cli.command('reconstruir-busqueda')
+def comando_reconstruir_busqueda():
+    """Reconstruye los índices de búsqueda de texto completo."""
+    for indice in reconstruir_indices_busqueda():
+        print(f"Índice reconstruido: {indice}")
+
+
+@app.cli.command('reconstruir-resumenes')
+def comando_reconstruir_resumenes():
+    """Recalcula desde cero las tablas de resumen de estadísticas."""
+    for tabla, filas in reconstruir_resumenes().items():
+        print(f"Resumen reconstruido: {tabla} ({filas} filas)")
+
+
+@app.cli.command('estadisticas-cache')
+def comando_estadisticas_cache():
+    """Muestra los aciertos y fallos de las cachés en memoria de este proceso."""
+    for nombre, datos in cache.estadisticas().items():
+        print(f"{nombre}: {datos['aciertos']} aciertos, {datos['fallos']} fallos, "
+              f"{datos['entradas']}/{datos['max_entradas']} entradas, TTL {datos['ttl']}s")
+
+
+@app.cli.command('inicializar-db')
+def comando_inicializar_db():
+    """Crea la base de datos con los datos iniciales, aplica las migraciones y crea el administrador."""
+    inicializar_db()
+    crear_admin_por_defecto()
+
+
+@app.cli.command('sembrar-db')
+@click.argument('ruta', required=False)
+@click.option('--tabla', help='Tabla de destino (obligatoria para CSV y JSONL)')
+@click.option('--conflicto', default='ABORT', show_default=True,
+              type=click.Choice(['ABORT', 'IGNORE', 'REPLACE'], case_sensitive=False),
+              help='Qué hacer con las filas que violan una restricción UNIQUE')
+def comando_sembrar_db(ruta, tabla, conflicto):
+    """Carga datos por lotes desde un script SQL (por defecto el inicial) o un volcado CSV/JSONL."""
+    comprobar_esquema()
+    ruta = ruta or SQL_PATH
+
+    if ruta.lower().endswith('.sql'):
+        resultado = sembrar_db(ruta)
+    else:
+        if not tabla:
+            raise click.UsageError('Indica la tabla de destino con --tabla')
+        try:
+            resultado = importar_datos(tabla, ruta, conflicto=conflicto)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+
+    for nombre, filas in resultado['filas'].items():
+        print(f"{nombre}: {filas} filas")
+    print(f"Cargadas {sum(resultado['filas'].values())} filas en {resultado['segundos']} s "
+          f"({resultado['filas_por_segundo']} filas/s)")
+
+
+@app.cli.command('importar-productos')
+@click.argument('ruta', type=click.Path(exists=True, dir_okay=False))
+@click.option('--formato', type=click.Choice(['csv', 'jsonl']), help='Por defecto, según la extensión')
+@click.option('--lote', type=int, help='Productos por transacción')
+def comando_importar_productos(ruta, formato, lote):
+    """Importa un catálogo CSV/JSONL insertando o actualizando productos por referencia."""
+    formato = formato or ('csv' if ruta.lower().endswith('.csv') else 'jsonl')
+    with open(ruta, 'r', encoding='utf-8-sig', newline='') as archivo:
+        resultado = Producto.importar_catalogo(leer_registros(archivo, formato), lote=lote)
+
+    print(f"Insertados: {resultado['insertados']}, actualizados: {resultado['actualizados']}, "
+          f"rechazados: {resultado['rechazados']}")
+    for error in resultado['errores']:
+        print(f"  Registro {error['registro']} ({error['referencia']}): {error['motivo']}")
+
+
+@app.cli.command('exportar')
+@click.argument('entidad', type=click.Choice(list(EXPORTACIONES)))
+@click.option('--formato', default='csv', show_default=True, type=click.Choice(list(FORMATOS_EXPORTACION)))
+@click.option('--desde', help='Primer día a incluir (AAAA-MM-DD)')
+@click.option('--hasta', help='Último día a incluir (AAAA-MM-DD)')
+@click.option('--cliente', 'cliente_id', type=int, help='ID del cliente (solo ventas)')
+@click.option('--proveedor', 'proveedor_id', type=int, help='ID del proveedor')
+@click.option('--categoria', help='Categoría (solo productos)')
+@click.option('--salida', default='-', help='Archivo de salida (por defecto, la salida estándar)')
+def comando_exportar(entidad, formato, salida, **filtros):
+    """Exporta ventas, compras o productos en CSV o JSONL por bloques."""
+    try:
+        bloques = exportar_datos(entidad, formato, **filtros)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+    with click.open_file(salida, 'w', encoding='utf-8') as archivo:
+        for bloque in bloques:
+            archivo.write(bloque)
 
 
 # ===================================================================
 # INICIALIZACIÓN DE LA APLICACIÓN
 # ===================================================================
 
-if __name__ == '__main__':
-    # Crear usuario administrador por defecto si no existe
+def crear_admin_por_defecto():
+    """Crea el usuario administrador por defecto si no existe."""
     admin = Usuario.get_by_username('admin')
     if not admin:
         nuevo_admin = Usuario(
@@ -1092,4 +1602,9 @@ if __name__ == '__main__':
         nuevo_admin.save()
         print("Usuario administrador creado: admin / admin123")
 
+
+if __name__ == '__main__':
+    create_app()
+    crear_admin_por_defecto()
+
     app.run(debug=True)
\ No newline at end of file
@@ -6,10 +6,309 @@ y sus métodos asociados para operaciones CRUD.
 
 """
 
-from db import get_db
+from db import get_db, conexion_lectura, sql_coste_venta
+import cache
+import seguridad
+import base64
 import datetime
 import hashlib
+import heapq
+import inspect
+import json
+import operator
 import os
+import re
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+# Ventanas (en días) a partir de las cuales el ranking de productos más vendidos
+# se resuelve con un montículo en lugar de ordenar todos los productos
+DIAS_RANKING_MONTICULO = 90
+
+# Segundos de vida de las lecturas cacheadas en memoria
+TTL_CACHE = {
+    'productos.destacados': int(os.environ.get('STORE_CACHE_TTL_DESTACADOS', 60)),
+    'productos.categorias': int(os.environ.get('STORE_CACHE_TTL_CATEGORIAS', 300)),
+    'proveedores.todos': int(os.environ.get('STORE_CACHE_TTL_PROVEEDORES', 300)),
+    'usuarios.por_id': int(os.environ.get('STORE_CACHE_TTL_USUARIOS', 60)),
+}
+
+# Filas que se leen de cada vez al recorrer una exportación
+LOTE_EXPORTACION = 1000
+
+# Productos por transacción en la importación de catálogos y máximo de
+# rechazos que se detallan en el informe (el resto solo se cuentan)
+LOTE_IMPORTACION = int(os.environ.get('STORE_LOTE_IMPORTACION', 1000))
+MAX_RECHAZOS_DETALLADOS = 100
+
+# Hilos usados para calcular en paralelo los bloques del panel de estadísticas
+# (cada uno con su propia conexión de lectura, fuera del pool de las peticiones)
+ESTADISTICAS_HILOS = int(os.environ.get('STORE_ESTADISTICAS_HILOS', 4))
+
+# Relevancia BM25 de la búsqueda de productos: pesos de nombre, referencia,
+# descripción y categoría (valores más bajos son más relevantes)
+RELEVANCIA_PRODUCTOS = "bm25(productos_fts, 10.0, 5.0, 1.0, 2.0)"
+
+
+def expresion_fts(texto):
+    """
+    Convierte un texto de búsqueda en una expresión MATCH de FTS5.
+
+    Cada palabra se busca como prefijo y todas deben aparecer. Los signos de
+    puntuación se descartan, de modo que el texto nunca se interpreta como
+    sintaxis de FTS5.
+
+    Args:
+        texto (str): Texto introducido por el usuario
+
+    Returns:
+        str: Expresión MATCH, o None si el texto no contiene palabras
+    """
+    palabras = re.findall(r'\w+', texto or '')
+    if not palabras:
+        return None
+    return ' '.join(f'"{palabra}"*' for palabra in palabras)
+
+
+def recorrer_consulta(query, params=()):
+    """
+    Ejecuta una consulta y devuelve sus filas de forma perezosa.
+
+    Las filas se leen del cursor en lotes de LOTE_EXPORTACION, así que la memoria
+    usada no depende del tamaño del resultado. La conexión queda ocupada hasta que
+    se agota o se cierra el generador.
+
+    Args:
+        query (str): Consulta SQL
+        params (tuple): Parámetros de la consulta
+
+    Yields:
+        dict: Cada fila como diccionario
+    """
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        while True:
+            filas = cursor.fetchmany(LOTE_EXPORTACION)
+            if not filas:
+                break
+            for row in filas:
+                yield dict(row)
+
+
+# Mapeadores fila -> objeto y clases de fila ligera ya generados
+_MAPEADORES = {}
+_FILAS_LIGERAS = {}
+_MAPEADORES_LOCK = threading.Lock()
+
+
+def columnas_cursor(cursor):
+    """
+    Obtiene los nombres de las columnas de la última consulta de un cursor.
+
+    Args:
+        cursor (sqlite3.Cursor): Cursor ya ejecutado
+
+    Returns:
+        tuple: Nombres de las columnas en orden
+    """
+    return tuple(descripcion[0] for descripcion in cursor.description)
+
+
+def mapeador(cls, columnas):
+    """
+    Obtiene la función que convierte una fila (tupla) en un objeto de ``cls``.
+
+    La función se genera una sola vez por clase y conjunto de columnas: las
+    posiciones de cada atributo se resuelven al generarla, así que por fila solo
+    se leen los valores por índice, sin pasar por sqlite3.Row. Las columnas que
+    no corresponden a ningún atributo se ignoran; las que son atributos pero no
+    argumentos de ``__init__`` (p. ej. ``relevancia``) se asignan después. Los
+    valores se convierten con ``cls._CONVERSIONES`` si la clase las declara.
+
+    Args:
+        cls (type): Clase del modelo
+        columnas (tuple): Nombres de las columnas de la consulta
+
+    Returns:
+        callable: Función ``crear(fila)`` que devuelve el objeto
+    """
+    clave = (cls, columnas)
+    crear = _MAPEADORES.get(clave)
+    if crear is not None:
+        return crear
+
+    posiciones = {}
+    for indice, columna in enumerate(columnas):
+        posiciones.setdefault(columna, indice)
+    parametros = [nombre for nombre in inspect.signature(cls).parameters if nombre in posiciones]
+    extras = [nombre for nombre in cls.__slots__
+              if nombre in posiciones and nombre not in parametros]
+    conversiones = getattr(cls, '_CONVERSIONES', {})
+    convertir = [(i, conversiones[nombre]) for i, nombre in enumerate(parametros)
+                 if nombre in conversiones]
+    leer_extras = [(nombre, posiciones[nombre]) for nombre in extras]
+    indices = [posiciones[nombre] for nombre in parametros]
+    leer = operator.itemgetter(*indices) if len(indices) > 1 else (lambda fila: (fila[indices[0]],))
+
+    def crear(fila):
+        valores = leer(fila)
+        if convertir:
+            valores = list(valores)
+            for i, conversion in convertir:
+                if valores[i] is not None:
+                    valores[i] = conversion(valores[i])
+        objeto = cls(**dict(zip(parametros, valores)))
+        for nombre, indice in leer_extras:
+            setattr(objeto, nombre, fila[indice])
+        return objeto
+
+    with _MAPEADORES_LOCK:
+        return _MAPEADORES.setdefault(clave, crear)
+
+
+def fila_ligera(columnas):
+    """
+    Obtiene la clase de fila ligera (namedtuple) para un conjunto de columnas.
+
+    Las filas ligeras son tuplas inmutables con acceso por atributo: ocupan
+    mucho menos que un objeto del modelo con sus relaciones y sirven para
+    listados y APIs JSON de solo lectura. Las columnas de tablas relacionadas
+    quedan como campos planos (p. ej. ``proveedor_nombre``).
+
+    Args:
+        columnas (tuple): Nombres de las columnas de la consulta
+
+    Returns:
+        type: Clase namedtuple, generada una sola vez por conjunto de columnas
+    """
+    clase = _FILAS_LIGERAS.get(columnas)
+    if clase is None:
+        with _MAPEADORES_LOCK:
+            clase = _FILAS_LIGERAS.setdefault(columnas, namedtuple('Fila', columnas, rename=True))
+    return clase
+
+
+def filas_ligeras(cursor):
+    """
+    Lee todas las filas de un cursor como filas ligeras.
+
+    Args:
+        cursor (sqlite3.Cursor): Cursor ya ejecutado
+
+    Returns:
+        list: Lista de namedtuples (véase ``fila_ligera``)
+    """
+    crear = fila_ligera(columnas_cursor(cursor))._make
+    return [crear(fila) for fila in cursor]
+
+
+def _filtro_fechas(columna, desde, hasta, condiciones, params):
+    """
+    Añade a una consulta el filtro por rango de fechas (ambos extremos incluidos).
+
+    Args:
+        columna (str): Columna de fecha
+        desde (str | datetime.date, optional): Primer día
+        hasta (str | datetime.date, optional): Último día
+        condiciones (list): Condiciones WHERE a completar
+        params (list): Parámetros a completar
+    """
+    if desde:
+        condiciones.append(f"{columna} >= ?")
+        params.append(str(desde))
+    if hasta:
+        condiciones.append(f"{columna} < date(?, '+1 day')")
+        params.append(str(hasta))
+
+
+def codificar_cursor(*valores):
+    """
+    Codifica la clave de ordenación de una fila como cursor opaco para URLs.
+
+    Args:
+        *valores: Valores de la clave de ordenación
+
+    Returns:
+        str: Cursor codificado
+    """
+    datos = json.dumps(valores, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(datos).decode('ascii').rstrip('=')
+
+
+def decodificar_cursor(cursor):
+    """
+    Decodifica un cursor generado con ``codificar_cursor``.
+
+    Args:
+        cursor (str): Cursor codificado
+
+    Returns:
+        tuple: Valores de la clave de ordenación, o None si el cursor no es válido
+    """
+    if not cursor:
+        return None
+    try:
+        relleno = '=' * (-len(cursor) % 4)
+        valores = json.loads(base64.urlsafe_b64decode(cursor + relleno))
+    except (ValueError, TypeError):
+        return None
+    return tuple(valores) if isinstance(valores, list) else None
+
+
+class Pagina:
+    """
+    Clase que representa una página de resultados paginados por cursor.
+
+    Attributes:
+        elementos (list): Objetos de la página
+        siguiente (str): Cursor de la página siguiente, None si es la última
+        anterior (str): Cursor de la página anterior, None si es la primera
+        total (int): Número total de resultados, si se ha calculado
+    """
+
+    def __init__(self, elementos, siguiente=None, anterior=None, total=None):
+        """Inicializa una instancia de Pagina."""
+        self.elementos = elementos
+        self.siguiente = siguiente
+        self.anterior = anterior
+        self.total = total
+
+    @classmethod
+    def desde_consulta(cls, elementos, por_pagina, clave, cursor, retroceder):
+        """
+        Construye una página a partir de una consulta que pidió ``por_pagina + 1`` filas.
+
+        Args:
+            elementos (list): Filas obtenidas, en el orden de presentación
+            por_pagina (int): Tamaño de página
+            clave (callable): Devuelve la tupla de ordenación de un elemento
+            cursor (tuple): Clave desde la que se ha consultado, si la hay
+            retroceder (bool): Si la consulta se hizo hacia la página anterior
+
+        Returns:
+            Pagina: Página con los cursores de navegación calculados
+        """
+        hay_mas = len(elementos) > por_pagina
+        if retroceder:
+            elementos = elementos[1:] if hay_mas else elementos
+            hay_siguiente, hay_anterior = cursor is not None, hay_mas
+        else:
+            elementos = elementos[:por_pagina]
+            hay_siguiente, hay_anterior = hay_mas, cursor is not None
+
+        return cls(
+            elementos,
+            siguiente=codificar_cursor(*clave(elementos[-1])) if hay_siguiente and elementos else None,
+            anterior=codificar_cursor(*clave(elementos[0])) if hay_anterior and elementos else None
+        )
+
+    def __iter__(self):
+        return iter(self.elementos)
+
+    def __len__(self):
+        return len(self.elementos)
 
 class Usuario:
     """
@@ -22,8 +321,11 @@ class Usuario:
         password (str): Contraseña hasheada
         es_admin (bool): Indica si el usuario tiene permisos de administrador
         fecha_registro (datetime): Fecha de registro del usuario
+        relevancia (float): Puntuación de la búsqueda que lo devolvió, si la hay
     """
 
+    __slots__ = ('id', 'username', 'email', 'password', 'es_admin', 'fecha_registro', 'relevancia')
+
     def __init__(self, id=None, username=None, email=None, password=None, es_admin=False, fecha_registro=None):
         """Inicializa una instancia de Usuario."""
         self.id = id
@@ -32,21 +334,25 @@ class Usuario:
         self.password = password
         self.es_admin = es_admin
         self.fecha_registro = fecha_registro
+        self.relevancia = None
 
     @staticmethod
     def hash_password(password):
         """
         Genera un hash de la contraseña proporcionada.
+
+        El cálculo se hace en el pool de hashing acotado (véase ``seguridad``).
         
         Args:
             password (str): Contraseña en texto plano
             
         Returns:
-            str: Hash de la contraseña
+            str: Hash de la contraseña con sus parámetros de coste
+
+        Raises:
+            HashSaturado: Si hay demasiadas operaciones de contraseña pendientes
         """
-        salt = os.urandom(32)
-        key = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, 100000)
-        return salt.hex() + ':' + key.hex()
+        return seguridad.hash_password(password)
 
     @staticmethod
     def verify_password(stored_password, provided_password):
@@ -59,12 +365,24 @@ class Usuario:
             
         Returns:
             bool: True si la contraseña coincide, False en caso contrario
+
+        Raises:
+            HashSaturado: Si hay demasiadas operaciones de contraseña pendientes
+        """
+        return seguridad.verify_password(stored_password, provided_password)
+
+    @staticmethod
+    def necesita_rehash(stored_password):
         """
-        salt_hex, key_hex = stored_password.split(':')
-        salt = bytes.fromhex(salt_hex)
-        stored_key = bytes.fromhex(key_hex)
-        new_key = hashlib.pbkdf2_hmac('sha256', provided_password.encode('utf-8'), salt, 100000)
-        return stored_key == new_key
+        Indica si el hash almacenado usa parámetros de coste distintos de los actuales.
+
+        Args:
+            stored_password (str): Hash almacenado
+
+        Returns:
+            bool: True si conviene regenerar el hash
+        """
+        return seguridad.necesita_rehash(stored_password)
 
     @classmethod
     def get_by_id(cls, usuario_id):
@@ -93,6 +411,25 @@ class Usuario:
                 )
             return None
 
+    @classmethod
+    @cache.cacheado('usuarios.por_id', TTL_CACHE['usuarios.por_id'], max_entradas=1024,
+                    tablas=('usuarios',))
+    def get_cacheado(cls, usuario_id):
+        """
+        Obtiene un usuario por su ID desde la caché en memoria.
+
+        Pensado para cargar el usuario de la sesión en cada petición; el objeto
+        devuelto es compartido, así que no debe modificarse (para editar un
+        usuario se usa get_by_id).
+
+        Args:
+            usuario_id (int): ID del usuario a buscar
+
+        Returns:
+            Usuario: Objeto Usuario si se encuentra, None en caso contrario
+        """
+        return cls.get_by_id(usuario_id)
+
     @classmethod
     def get_by_username(cls, username):
         """
@@ -147,37 +484,126 @@ class Usuario:
                 VALUES (?, ?, ?, ?)
                 """, (self.username, self.email, self.password, self.es_admin))
                 self.id = cursor.lastrowid
+
+            cache.invalidar('usuarios.por_id')
                 
             return self.id
 
     @classmethod
-    def buscar(cls, texto):
-        """Busca usuarios por nombre de usuario o email."""
+    def buscar(cls, texto, limite=None, despues=None, antes=None):
+        """
+        Busca usuarios por nombre de usuario o email.
+
+        Con 3 o más caracteres se busca la subcadena en el índice de trigramas y
+        los resultados se ordenan por (relevancia, id). Con menos caracteres se
+        buscan los nombres de usuario que empiezan por el texto, ordenados por
+        (username, id).
+
+        Args:
+            texto (str): Texto a buscar
+            limite (int, optional): Número máximo de usuarios a devolver
+            despues (tuple, optional): Clave de ordenación tras la que empezar
+            antes (tuple, optional): Clave de ordenación antes de la que terminar
+
+        Returns:
+            list: Lista de objetos Usuario
+        """
         with get_db() as conn:
             cursor = conn.cursor()
-            query = """
-                SELECT * FROM usuarios
-                WHERE username LIKE ? OR email LIKE ?
-                ORDER BY username
-            """
-            like_text = f"%{texto}%"
-            cursor.execute(query, (like_text, like_text))
-            return [
-                cls(
+
+            if len(texto) >= 3:
+                query = """
+                    SELECT u.*, bm25(usuarios_fts) as relevancia
+                    FROM usuarios_fts
+                    JOIN usuarios u ON u.id = usuarios_fts.rowid
+                    WHERE usuarios_fts MATCH ?
+                """
+                params = ['"' + texto.replace('"', '""') + '"']
+                orden = "bm25(usuarios_fts)"
+            else:
+                query = """
+                    SELECT u.*
+                    FROM usuarios u
+                    WHERE u.username LIKE ? ESCAPE '\\'
+                """
+                like_text = re.sub(r'([%_\\])', r'\\\1', texto) + '%'
+                params = [like_text]
+                orden = "u.username COLLATE NOCASE"
+
+            if despues:
+                query += f" AND ({orden}, u.id) > (?, ?)"
+                params.extend(despues)
+            elif antes:
+                query += f" AND ({orden}, u.id) < (?, ?)"
+                params.extend(antes)
+
+            # Hacia atrás se recorre en orden inverso y se da la vuelta al final
+            if antes and not despues:
+                query += f" ORDER BY {orden} DESC, u.id DESC"
+            else:
+                query += f" ORDER BY {orden}, u.id"
+
+            if limite:
+                query += " LIMIT ?"
+                params.append(limite)
+
+            cursor.execute(query, params)
+
+            usuarios = []
+            for row in cursor.fetchall():
+                usuario = cls(
                     id=row['id'],
                     username=row['username'],
                     email=row['email'],
                     password=row['password'],
                     es_admin=bool(row['es_admin']),
                     fecha_registro=row['fecha_registro']
-                ) for row in cursor.fetchall()
-            ]
+                )
+                usuario.relevancia = row['relevancia'] if len(texto) >= 3 else None
+                usuarios.append(usuario)
+
+            if antes and not despues:
+                usuarios.reverse()
+
+            return usuarios
+
+    @classmethod
+    def buscar_pagina(cls, texto, por_pagina=50, cursor=None, retroceder=False):
+        """
+        Busca usuarios devolviendo una página paginada por cursor.
+
+        Args:
+            texto (str): Texto a buscar
+            por_pagina (int): Número de usuarios por página
+            cursor (str, optional): Cursor devuelto en una página anterior
+            retroceder (bool): Si el cursor apunta a la página anterior
+
+        Returns:
+            Pagina: Página de objetos Usuario
+        """
+        clave = decodificar_cursor(cursor)
+        retroceder = retroceder and clave is not None
+
+        usuarios = cls.buscar(
+            texto,
+            limite=por_pagina + 1,
+            despues=None if retroceder else clave,
+            antes=clave if retroceder else None
+        )
+
+        if len(texto) >= 3:
+            clave_orden = lambda usuario: (usuario.relevancia, usuario.id)
+        else:
+            clave_orden = lambda usuario: (usuario.username, usuario.id)
+
+        return Pagina.desde_consulta(usuarios, por_pagina, clave_orden, clave, retroceder)
 
     def delete(self):
         """Elimina el usuario de la base de datos."""
         with get_db() as conn:
             cursor = conn.cursor()
             cursor.execute("DELETE FROM usuarios WHERE id = ?", (self.id,))
+            cache.invalidar('usuarios.por_id')
             return cursor.rowcount > 0
 
 
@@ -197,6 +623,9 @@ class Proveedor:
         notas (str): Notas adicionales
     """
 
+    __slots__ = ('id', 'nombre', 'cif', 'direccion', 'telefono', 'email',
+                 'porcentaje_descuento', 'iva', 'notas')
+
     def __init__(self, id=None, nombre=None, cif=None, direccion=None, telefono=None, 
                  email=None, porcentaje_descuento=0, iva=21, notas=None):
         """Inicializa una instancia de Proveedor."""
@@ -241,6 +670,8 @@ class Proveedor:
             return None
 
     @classmethod
+    @cache.cacheado('proveedores.todos', TTL_CACHE['proveedores.todos'],
+                    tablas=('proveedores',))
     def get_all(cls):
         """
         Obtiene todos los proveedores.
@@ -298,6 +729,8 @@ class Proveedor:
                 """, (self.nombre, self.cif, self.direccion, self.telefono, 
                       self.email, self.porcentaje_descuento, self.iva, self.notas))
                 self.id = cursor.lastrowid
+
+            cache.invalidar('proveedores.todos')
                 
             return self.id
 
@@ -347,6 +780,7 @@ class Proveedor:
                 return False
                 
             cursor.execute("DELETE FROM proveedores WHERE id = ?", (self.id,))
+            cache.invalidar('proveedores.todos')
             return cursor.rowcount > 0
 
 
@@ -368,8 +802,13 @@ class Producto:
         imagen (str): Ruta a la imagen del producto
         proveedor_id (int): ID del proveedor
         proveedor (Proveedor): Objeto proveedor (relación)
+        relevancia (float): Puntuación de la búsqueda que lo devolvió, si la hay
     """
 
+    __slots__ = ('id', 'nombre', 'referencia', 'descripcion', 'precio_compra', 'precio_venta',
+                 'stock_actual', 'stock_minimo', 'ubicacion_almacen', 'categoria', 'imagen',
+                 'proveedor_id', 'proveedor', 'relevancia')
+
     def __init__(self, id=None, nombre=None, referencia=None, descripcion=None,
                  precio_compra=0, precio_venta=0, stock_actual=0, stock_minimo=0,
                  ubicacion_almacen=None, categoria=None, imagen=None, proveedor_id=None,
@@ -388,6 +827,7 @@ class Producto:
         self.imagen = imagen
         self.proveedor_id = proveedor_id
         self.proveedor = proveedor
+        self.relevancia = None
 
     @classmethod
     def get_by_id(cls, producto_id):
@@ -437,140 +877,198 @@ class Producto:
             return None
 
     @classmethod
-    def get_all(cls, busqueda=None, categoria=None):
+    def get_all(cls, busqueda=None, categoria=None, limite=None, despues=None, antes=None,
+                ligero=False):
         """
         Obtiene todos los productos con filtros opcionales.
+
+        Sin búsqueda, los productos se ordenan por (nombre, id). Con búsqueda se
+        usa el índice de texto completo y se ordenan por (relevancia, id). Con
+        ``despues`` o ``antes`` se continúa a partir de esa clave, lo que permite
+        paginar sin OFFSET. Los productos de un mismo proveedor comparten el
+        objeto ``proveedor``.
         
         Args:
-            busqueda (str, optional): Texto para filtrar por nombre o referencia
+            busqueda (str, optional): Texto para buscar en nombre, referencia,
+                descripción y categoría
             categoria (str, optional): Categoría para filtrar
+            limite (int, optional): Número máximo de productos a devolver
+            despues (tuple, optional): Clave de ordenación tras la que empezar
+            antes (tuple, optional): Clave de ordenación antes de la que terminar
+            ligero (bool): Si se devuelven filas ligeras de solo lectura en lugar
+                de objetos Producto (véase ``fila_ligera``)
             
         Returns:
-            list: Lista de objetos Producto
+            list: Lista de objetos Producto (o de filas ligeras)
         """
         with get_db() as conn:
             cursor = conn.cursor()
-            
-            query = """
-            SELECT p.*, prov.nombre as proveedor_nombre
-            FROM productos p
-            LEFT JOIN proveedores prov ON p.proveedor_id = prov.id
-            """
-            
+            cursor.row_factory = None
+
             params = []
             conditions = []
-            
-            if busqueda:
-                conditions.append("(p.nombre LIKE ? OR p.referencia LIKE ?)")
-                params.extend([f"%{busqueda}%", f"%{busqueda}%"])
+            expresion = expresion_fts(busqueda)
+
+            if expresion:
+                query = f"""
+                SELECT p.*, prov.nombre as proveedor_nombre, {RELEVANCIA_PRODUCTOS} as relevancia
+                FROM productos_fts
+                JOIN productos p ON p.id = productos_fts.rowid
+                LEFT JOIN proveedores prov ON p.proveedor_id = prov.id
+                """
+                conditions.append("productos_fts MATCH ?")
+                params.append(expresion)
+                orden = RELEVANCIA_PRODUCTOS
+            else:
+                query = """
+                SELECT p.*, prov.nombre as proveedor_nombre
+                FROM productos p
+                LEFT JOIN proveedores prov ON p.proveedor_id = prov.id
+                """
+                orden = "p.nombre"
                 
             if categoria:
                 conditions.append("p.categoria = ?")
                 params.append(categoria)
+
+            if despues:
+                conditions.append(f"({orden}, p.id) > (?, ?)")
+                params.extend(despues)
+            elif antes:
+                conditions.append(f"({orden}, p.id) < (?, ?)")
+                params.extend(antes)
                 
             if conditions:
                 query += " WHERE " + " AND ".join(conditions)
-                
-            query += " ORDER BY p.nombre"
+
+            # Hacia atrás se recorre en orden inverso y se da la vuelta al final
+            if antes and not despues:
+                query += f" ORDER BY {orden} DESC, p.id DESC"
+            else:
+                query += f" ORDER BY {orden}, p.id"
+
+            if limite:
+                query += " LIMIT ?"
+                params.append(limite)
             
             cursor.execute(query, params)
-            
-            productos = []
-            for row in cursor.fetchall():
-                producto = cls(
-                    id=row['id'],
-                    nombre=row['nombre'],
-                    referencia=row['referencia'],
-                    descripcion=row['descripcion'],
-                    precio_compra=row['precio_compra'],
-                    precio_venta=row['precio_venta'],
-                    stock_actual=row['stock_actual'],
-                    stock_minimo=row['stock_minimo'],
-                    ubicacion_almacen=row['ubicacion_almacen'],
-                    categoria=row['categoria'],
-                    imagen=row['imagen'],
-                    proveedor_id=row['proveedor_id']
-                )
-                
-                if producto.proveedor_id:
-                    producto.proveedor = Proveedor(
-                        id=row['proveedor_id'],
-                        nombre=row['proveedor_nombre']
-                    )
-                
-                productos.append(producto)
+
+            if ligero:
+                productos = filas_ligeras(cursor)
+            else:
+                columnas = columnas_cursor(cursor)
+                crear = mapeador(cls, columnas)
+                indice_proveedor = columnas.index('proveedor_nombre')
+                proveedores = {}
+                productos = []
+                for fila in cursor:
+                    producto = crear(fila)
+                    if producto.proveedor_id:
+                        producto.proveedor = proveedores.get(producto.proveedor_id)
+                        if producto.proveedor is None:
+                            producto.proveedor = proveedores[producto.proveedor_id] = Proveedor(
+                                id=producto.proveedor_id,
+                                nombre=fila[indice_proveedor]
+                            )
+                    productos.append(producto)
+
+            if antes and not despues:
+                productos.reverse()
                 
             return productos
 
     @classmethod
-    def get_by_proveedor(cls, proveedor_id):
+    def get_pagina(cls, busqueda=None, categoria=None, por_pagina=24, cursor=None, retroceder=False):
+        """
+        Obtiene una página del catálogo paginada por cursor.
+
+        El cursor se basa en (nombre, id), o en (relevancia, id) si hay búsqueda.
+
+        Args:
+            busqueda (str, optional): Texto para buscar en el catálogo
+            categoria (str, optional): Categoría para filtrar
+            por_pagina (int): Número de productos por página
+            cursor (str, optional): Cursor devuelto en una página anterior
+            retroceder (bool): Si el cursor apunta a la página anterior
+
+        Returns:
+            Pagina: Página de objetos Producto
+        """
+        clave = decodificar_cursor(cursor)
+        retroceder = retroceder and clave is not None
+
+        productos = cls.get_all(
+            busqueda=busqueda,
+            categoria=categoria,
+            limite=por_pagina + 1,
+            despues=None if retroceder else clave,
+            antes=clave if retroceder else None
+        )
+
+        if expresion_fts(busqueda):
+            clave_orden = lambda producto: (producto.relevancia, producto.id)
+        else:
+            clave_orden = lambda producto: (producto.nombre, producto.id)
+
+        return Pagina.desde_consulta(productos, por_pagina, clave_orden, clave, retroceder)
+
+    @classmethod
+    def get_by_proveedor(cls, proveedor_id, ligero=False):
         """
         Obtiene todos los productos de un proveedor específico.
         
         Args:
             proveedor_id (int): ID del proveedor
+            ligero (bool): Si se devuelven filas ligeras de solo lectura
             
         Returns:
-            list: Lista de objetos Producto
+            list: Lista de objetos Producto (o de filas ligeras)
         """
         with get_db() as conn:
             cursor = conn.cursor()
+            cursor.row_factory = None
             cursor.execute("""
             SELECT * FROM productos WHERE proveedor_id = ?
             ORDER BY nombre
             """, (proveedor_id,))
-            
-            return [cls(
-                id=row['id'],
-                nombre=row['nombre'],
-                referencia=row['referencia'],
-                descripcion=row['descripcion'],
-                precio_compra=row['precio_compra'],
-                precio_venta=row['precio_venta'],
-                stock_actual=row['stock_actual'],
-                stock_minimo=row['stock_minimo'],
-                ubicacion_almacen=row['ubicacion_almacen'],
-                categoria=row['categoria'],
-                imagen=row['imagen'],
-                proveedor_id=row['proveedor_id']
-            ) for row in cursor.fetchall()]
+
+            if ligero:
+                return filas_ligeras(cursor)
+            crear = mapeador(cls, columnas_cursor(cursor))
+            return [crear(fila) for fila in cursor]
 
     @classmethod
-    def get_destacados(cls, limit=4):
+    @cache.cacheado('productos.destacados', TTL_CACHE['productos.destacados'], max_entradas=16,
+                    tablas=('productos',))
+    def get_destacados(cls, limit=4, ligero=False):
         """
         Obtiene los productos destacados (mayor margen).
         
         Args:
             limit (int): Número máximo de productos a devolver
+            ligero (bool): Si se devuelven filas ligeras de solo lectura
             
         Returns:
-            list: Lista de objetos Producto
+            list: Lista de objetos Producto (o de filas ligeras)
         """
         with get_db() as conn:
             cursor = conn.cursor()
+            cursor.row_factory = None
             cursor.execute("""
             SELECT * FROM productos
             WHERE stock_actual > 0
             ORDER BY (precio_venta - precio_compra) / precio_compra DESC, stock_actual DESC
             LIMIT ?
             """, (limit,))
-            
-            return [cls(
-                id=row['id'],
-                nombre=row['nombre'],
-                referencia=row['referencia'],
-                descripcion=row['descripcion'],
-                precio_compra=row['precio_compra'],
-                precio_venta=row['precio_venta'],
-                stock_actual=row['stock_actual'],
-                stock_minimo=row['stock_minimo'],
-                ubicacion_almacen=row['ubicacion_almacen'],
-                categoria=row['categoria'],
-                imagen=row['imagen'],
-                proveedor_id=row['proveedor_id']
-            ) for row in cursor.fetchall()]
+
+            if ligero:
+                return filas_ligeras(cursor)
+            crear = mapeador(cls, columnas_cursor(cursor))
+            return [crear(fila) for fila in cursor]
             
     @classmethod
+    @cache.cacheado('productos.categorias', TTL_CACHE['productos.categorias'], max_entradas=1,
+                    tablas=('productos',))
     def get_categorias(cls):
         """
         Obtiene todas las categorías distintas.
@@ -588,6 +1086,228 @@ class Producto:
             
             return [row['categoria'] for row in cursor.fetchall()]
 
+    @staticmethod
+    def invalidar_cache(solo_stock=False):
+        """
+        Invalida las lecturas de productos guardadas en memoria.
+
+        Args:
+            solo_stock (bool): Si solo ha cambiado el stock (ventas y compras), en
+                cuyo caso las categorías siguen siendo válidas
+        """
+        cache.invalidar('productos.destacados')
+        if not solo_stock:
+            cache.invalidar('productos.categorias')
+        Estadisticas.invalidar_stock_critico()
+
+    @staticmethod
+    def exportar(proveedor_id=None, categoria=None):
+        """
+        Recorre el catálogo de productos para exportarlo.
+
+        Args:
+            proveedor_id (int, optional): Solo productos de este proveedor
+            categoria (str, optional): Solo productos de esta categoría
+
+        Yields:
+            dict: Cada producto con el nombre de su proveedor
+        """
+        condiciones, params = [], []
+        if proveedor_id:
+            condiciones.append("p.proveedor_id = ?")
+            params.append(proveedor_id)
+        if categoria:
+            condiciones.append("p.categoria = ?")
+            params.append(categoria)
+
+        query = """
+        SELECT p.id, p.referencia, p.nombre, p.descripcion, p.categoria,
+               p.precio_compra, p.precio_venta, p.stock_actual, p.stock_minimo,
+               p.ubicacion_almacen, p.proveedor_id, prov.cif as proveedor_cif,
+               prov.nombre as proveedor
+        FROM productos p
+        LEFT JOIN proveedores prov ON prov.id = p.proveedor_id
+        """
+        if condiciones:
+            query += " WHERE " + " AND ".join(condiciones)
+        query += " ORDER BY p.id"
+
+        return recorrer_consulta(query, params)
+
+    @staticmethod
+    def _normalizar_importacion(registro, proveedores, ids_proveedores):
+        """
+        Valida un registro de catálogo y lo convierte en parámetros del upsert.
+
+        Args:
+            registro (dict): Registro leído del CSV/JSONL
+            proveedores (dict): ID de proveedor por CIF (en mayúsculas)
+            ids_proveedores (set): IDs de todos los proveedores
+
+        Returns:
+            tuple: Parámetros del upsert, en el orden de sus columnas
+
+        Raises:
+            ValueError: Si el registro no es válido (el mensaje indica el motivo)
+        """
+        def texto(campo):
+            valor = registro.get(campo)
+            if valor is None:
+                return None
+            valor = str(valor).strip()
+            return valor or None
+
+        def numero(campo, tipo, obligatorio=False):
+            valor = texto(campo)
+            if valor is None:
+                if obligatorio:
+                    raise ValueError(f"Falta {campo}")
+                return None
+            try:
+                valor = tipo(valor.replace(',', '.') if tipo is float else valor)
+            except ValueError:
+                raise ValueError(f"Valor no válido en {campo}: {valor}")
+            if valor < 0:
+                raise ValueError(f"{campo} no puede ser negativo")
+            return valor
+
+        if not isinstance(registro, dict):
+            raise ValueError("Registro con formato no válido")
+
+        referencia = texto('referencia')
+        nombre = texto('nombre')
+        if not referencia:
+            raise ValueError("Falta la referencia")
+        if not nombre:
+            raise ValueError("Falta el nombre")
+
+        proveedor_id = None
+        cif = texto('proveedor_cif') or texto('cif')
+        if cif:
+            proveedor_id = proveedores.get(cif.upper())
+            if proveedor_id is None:
+                raise ValueError(f"Proveedor desconocido con CIF {cif}")
+        elif texto('proveedor_id'):
+            proveedor_id = numero('proveedor_id', int)
+            if proveedor_id not in ids_proveedores:
+                raise ValueError(f"Proveedor desconocido con ID {proveedor_id}")
+
+        return (
+            referencia,
+            nombre,
+            texto('descripcion'),
+            numero('precio_compra', float, obligatorio=True),
+            numero('precio_venta', float, obligatorio=True),
+            numero('stock_actual', int),
+            numero('stock_minimo', int),
+            texto('ubicacion_almacen'),
+            texto('categoria'),
+            texto('imagen'),
+            proveedor_id,
+        )
+
+    @classmethod
+    def importar_catalogo(cls, registros, lote=None):
+        """
+        Importa un catálogo de productos insertando o actualizando por referencia.
+
+        Los registros se procesan en lotes: cada lote es un único
+        ``INSERT ... ON CONFLICT (referencia) DO UPDATE`` ejecutado con executemany
+        en su propia transacción, que se confirma al terminar el lote. Si el hilo
+        ya tenía una transacción abierta (p. ej. la de la petición), se confirma
+        antes de empezar, de modo que el bloqueo de escritura nunca se mantiene
+        durante toda la importación. El proveedor se indica por CIF
+        (``proveedor_cif``) o por ``proveedor_id`` y se resuelve con un mapa
+        cargado una sola vez. Los campos opcionales vacíos no sobrescriben los
+        valores existentes.
+
+        Si la lectura de los registros falla a mitad, los lotes anteriores ya
+        están guardados.
+
+        Args:
+            registros (iterable): Diccionarios con los campos del producto
+            lote (int, optional): Productos por lote (por defecto LOTE_IMPORTACION)
+
+        Returns:
+            dict: Productos insertados, actualizados y rechazados, con el detalle
+                de los primeros rechazos (número de registro, referencia y motivo)
+        """
+        lote = lote or LOTE_IMPORTACION
+        resultado = {'insertados': 0, 'actualizados': 0, 'rechazados': 0, 'errores': []}
+
+        with get_db() as conn:
+            filas_proveedores = conn.execute("SELECT id, cif FROM proveedores").fetchall()
+        proveedores = {row['cif'].strip().upper(): row['id']
+                       for row in filas_proveedores if row['cif']}
+        ids_proveedores = {row['id'] for row in filas_proveedores}
+
+        query = """
+        INSERT INTO productos (referencia, nombre, descripcion, precio_compra, precio_venta,
+                               stock_actual, stock_minimo, ubicacion_almacen, categoria,
+                               imagen, proveedor_id)
+        VALUES (?1, ?2, ?3, ?4, ?5, IFNULL(?6, 0), IFNULL(?7, 0), ?8, ?9, ?10, ?11)
+        ON CONFLICT (referencia) DO UPDATE SET
+            nombre = ?2,
+            descripcion = COALESCE(?3, descripcion),
+            precio_compra = ?4,
+            precio_venta = ?5,
+            stock_actual = COALESCE(?6, stock_actual),
+            stock_minimo = COALESCE(?7, stock_minimo),
+            ubicacion_almacen = COALESCE(?8, ubicacion_almacen),
+            categoria = COALESCE(?9, categoria),
+            imagen = COALESCE(?10, imagen),
+            proveedor_id = COALESCE(?11, proveedor_id)
+        """
+
+        def cargar(filas):
+            referencias = [fila[0] for fila in filas]
+            with get_db() as conn:
+                # Cada lote es una transacción propia, también dentro de una petición
+                if conn.in_transaction:
+                    conn.commit()
+                conn.execute("BEGIN IMMEDIATE")
+                cursor = conn.cursor()
+                cursor.execute("""
+                SELECT referencia FROM productos
+                WHERE referencia IN (SELECT value FROM json_each(?))
+                """, (json.dumps(referencias),))
+                existentes = {row['referencia'] for row in cursor.fetchall()}
+                cursor.executemany(query, filas)
+                conn.commit()
+
+            # Una referencia repetida dentro del lote cuenta como actualización
+            for referencia in referencias:
+                if referencia in existentes:
+                    resultado['actualizados'] += 1
+                else:
+                    resultado['insertados'] += 1
+                    existentes.add(referencia)
+
+        pendientes = []
+        try:
+            for numero, registro in enumerate(registros, start=1):
+                try:
+                    pendientes.append(cls._normalizar_importacion(registro, proveedores,
+                                                                  ids_proveedores))
+                except ValueError as e:
+                    resultado['rechazados'] += 1
+                    if len(resultado['errores']) < MAX_RECHAZOS_DETALLADOS:
+                        referencia = registro.get('referencia') if isinstance(registro, dict) else None
+                        resultado['errores'].append({'registro': numero, 'referencia': referencia,
+                                                     'motivo': str(e)})
+                    continue
+
+                if len(pendientes) >= lote:
+                    cargar(pendientes)
+                    pendientes = []
+
+            if pendientes:
+                cargar(pendientes)
+        finally:
+            # Los lotes ya confirmados deben verse aunque la importación se interrumpa
+            Producto.invalidar_cache()
+        return resultado
+
     def save(self):
         """
         Guarda o actualiza el producto en la base de datos.
@@ -629,6 +1349,8 @@ class Producto:
                       self.precio_venta, self.stock_actual, self.stock_minimo,
                       self.ubicacion_almacen, self.categoria, self.imagen, self.proveedor_id))
                 self.id = cursor.lastrowid
+
+            Producto.invalidar_cache()
                 
             return self.id
 
@@ -684,6 +1406,7 @@ class Producto:
                 return False
                 
             cursor.execute("DELETE FROM productos WHERE id = ?", (self.id,))
+            Producto.invalidar_cache()
             return cursor.rowcount > 0
 
 
@@ -699,6 +1422,11 @@ class Venta:
         cliente (Usuario): Objeto usuario cliente (relación)
     """
 
+    __slots__ = ('id', 'cliente_id', 'fecha', 'total', 'cliente')
+
+    # Conversiones de columnas al construir objetos desde filas (véase ``mapeador``)
+    _CONVERSIONES = {'fecha': datetime.datetime.fromisoformat}
+
     def __init__(self, id=None, cliente_id=None, fecha=None, total=0, cliente=None):
         """Inicializa una instancia de Venta."""
         self.id = id
@@ -746,117 +1474,250 @@ class Venta:
             return None
 
     @classmethod
-    def get_by_cliente(cls, cliente_id, desde=None, hasta=None):
+    def _consultar(cls, cliente_id=None, desde=None, hasta=None, limite=None,
+                   despues=None, antes=None, ligero=False):
         """
-        Obtiene todas las ventas de un cliente con filtros opcionales.
-        
+        Consulta ventas ordenadas por (fecha, id) descendente.
+
+        Las ventas de un mismo cliente comparten el objeto ``cliente``.
+
         Args:
-            cliente_id (int): ID del cliente
+            cliente_id (int, optional): ID del cliente para filtrar
             desde (datetime, optional): Fecha de inicio para filtrar
             hasta (datetime, optional): Fecha de fin para filtrar
-            
+            limite (int, optional): Número máximo de ventas a devolver
+            despues (tuple, optional): Clave (fecha, id) tras la que empezar
+            antes (tuple, optional): Clave (fecha, id) antes de la que terminar
+            ligero (bool): Si se devuelven filas ligeras de solo lectura (con
+                ``fecha`` como texto y ``username``/``email`` del cliente)
+
         Returns:
-            list: Lista de objetos Venta
+            list: Lista de objetos Venta (o de filas ligeras)
         """
         with get_db() as conn:
             cursor = conn.cursor()
+            cursor.row_factory = None
             
             query = """
             SELECT v.*, u.username, u.email
             FROM ventas v
             JOIN usuarios u ON v.cliente_id = u.id
-            WHERE v.cliente_id = ?
             """
             
-            params = [cliente_id]
+            params = []
+            conditions = []
+
+            if cliente_id:
+                conditions.append("v.cliente_id = ?")
+                params.append(cliente_id)
             
             if desde:
-                query += " AND v.fecha >= ?"
-                params.append(desde.isoformat())
+                conditions.append("v.fecha >= ?")
+                params.append(desde.isoformat(sep=' '))
                 
             if hasta:
-                query += " AND v.fecha <= ?"
-                params.append(hasta.isoformat())
-                
-            query += " ORDER BY v.fecha DESC"
+                conditions.append("v.fecha <= ?")
+                params.append(hasta.isoformat(sep=' '))
+
+            if despues:
+                conditions.append("(v.fecha, v.id) < (?, ?)")
+                params.extend(despues)
+            elif antes:
+                conditions.append("(v.fecha, v.id) > (?, ?)")
+                params.extend(antes)
+
+            if conditions:
+                query += " WHERE " + " AND ".join(conditions)
+
+            # Hacia atrás se recorre en orden inverso y se da la vuelta al final
+            if antes and not despues:
+                query += " ORDER BY v.fecha, v.id"
+            else:
+                query += " ORDER BY v.fecha DESC, v.id DESC"
+
+            if limite:
+                query += " LIMIT ?"
+                params.append(limite)
             
             cursor.execute(query, params)
-            
-            ventas = []
-            for row in cursor.fetchall():
-                venta = cls(
-                    id=row['id'],
-                    cliente_id=row['cliente_id'],
-                    fecha=datetime.datetime.fromisoformat(row['fecha']),
-                    total=row['total']
-                )
-                
-                venta.cliente = Usuario(
-                    id=row['cliente_id'],
-                    username=row['username'],
-                    email=row['email']
-                )
-                
-                ventas.append(venta)
+
+            if ligero:
+                ventas = filas_ligeras(cursor)
+            else:
+                columnas = columnas_cursor(cursor)
+                crear = mapeador(cls, columnas)
+                indice_username = columnas.index('username')
+                indice_email = columnas.index('email')
+                clientes = {}
+                ventas = []
+                for fila in cursor:
+                    venta = crear(fila)
+                    venta.cliente = clientes.get(venta.cliente_id)
+                    if venta.cliente is None:
+                        venta.cliente = clientes[venta.cliente_id] = Usuario(
+                            id=venta.cliente_id,
+                            username=fila[indice_username],
+                            email=fila[indice_email]
+                        )
+                    ventas.append(venta)
+
+            if antes and not despues:
+                ventas.reverse()
                 
             return ventas
 
     @classmethod
-    def get_all(cls, desde=None, hasta=None):
+    def get_by_cliente(cls, cliente_id, desde=None, hasta=None, limite=None,
+                       despues=None, antes=None):
         """
-        Obtiene todas las ventas con filtros opcionales.
+        Obtiene todas las ventas de un cliente con filtros opcionales.
         
         Args:
+            cliente_id (int): ID del cliente
             desde (datetime, optional): Fecha de inicio para filtrar
             hasta (datetime, optional): Fecha de fin para filtrar
+            limite (int, optional): Número máximo de ventas a devolver
+            despues (tuple, optional): Clave (fecha, id) tras la que empezar
+            antes (tuple, optional): Clave (fecha, id) antes de la que terminar
             
         Returns:
             list: Lista de objetos Venta
         """
+        return cls._consultar(cliente_id=cliente_id, desde=desde, hasta=hasta,
+                              limite=limite, despues=despues, antes=antes)
+
+    @classmethod
+    def get_all(cls, desde=None, hasta=None, limite=None, despues=None, antes=None,
+                ligero=False):
+        """
+        Obtiene todas las ventas con filtros opcionales.
+        
+        Args:
+            desde (datetime, optional): Fecha de inicio para filtrar
+            hasta (datetime, optional): Fecha de fin para filtrar
+            limite (int, optional): Número máximo de ventas a devolver
+            despues (tuple, optional): Clave (fecha, id) tras la que empezar
+            antes (tuple, optional): Clave (fecha, id) antes de la que terminar
+            ligero (bool): Si se devuelven filas ligeras de solo lectura
+            
+        Returns:
+            list: Lista de objetos Venta (o de filas ligeras)
+        """
+        return cls._consultar(desde=desde, hasta=hasta, limite=limite,
+                              despues=despues, antes=antes, ligero=ligero)
+
+    @classmethod
+    def contar(cls, cliente_id=None, desde=None, hasta=None):
+        """
+        Cuenta las ventas que cumplen los filtros.
+
+        Args:
+            cliente_id (int, optional): ID del cliente para filtrar
+            desde (datetime, optional): Fecha de inicio para filtrar
+            hasta (datetime, optional): Fecha de fin para filtrar
+
+        Returns:
+            int: Número de ventas
+        """
         with get_db() as conn:
             cursor = conn.cursor()
-            
-            query = """
-            SELECT v.*, u.username, u.email
-            FROM ventas v
-            JOIN usuarios u ON v.cliente_id = u.id
-            """
-            
+
+            query = "SELECT COUNT(*) FROM ventas"
             params = []
-            
+            conditions = []
+
+            if cliente_id:
+                conditions.append("cliente_id = ?")
+                params.append(cliente_id)
+
             if desde:
-                query += " WHERE v.fecha >= ?"
-                params.append(desde.isoformat())
-                
-                if hasta:
-                    query += " AND v.fecha <= ?"
-                    params.append(hasta.isoformat())
-            elif hasta:
-                query += " WHERE v.fecha <= ?"
-                params.append(hasta.isoformat())
-                
-            query += " ORDER BY v.fecha DESC"
-            
+                conditions.append("fecha >= ?")
+                params.append(desde.isoformat(sep=' '))
+
+            if hasta:
+                conditions.append("fecha <= ?")
+                params.append(hasta.isoformat(sep=' '))
+
+            if conditions:
+                query += " WHERE " + " AND ".join(conditions)
+
             cursor.execute(query, params)
-            
-            ventas = []
-            for row in cursor.fetchall():
-                venta = cls(
-                    id=row['id'],
-                    cliente_id=row['cliente_id'],
-                    fecha=datetime.datetime.fromisoformat(row['fecha']),
-                    total=row['total']
-                )
-                
-                venta.cliente = Usuario(
-                    id=row['cliente_id'],
-                    username=row['username'],
-                    email=row['email']
-                )
-                
-                ventas.append(venta)
-                
-            return ventas
+            return cursor.fetchone()[0]
+
+    @classmethod
+    def get_pagina(cls, cliente_id=None, desde=None, hasta=None, por_pagina=50,
+                   cursor=None, retroceder=False, con_total=False):
+        """
+        Obtiene una página de ventas paginada por cursor sobre (fecha, id) descendente.
+
+        Args:
+            cliente_id (int, optional): ID del cliente para filtrar
+            desde (datetime, optional): Fecha de inicio para filtrar
+            hasta (datetime, optional): Fecha de fin para filtrar
+            por_pagina (int): Número de ventas por página
+            cursor (str, optional): Cursor devuelto en una página anterior
+            retroceder (bool): Si el cursor apunta a la página anterior
+            con_total (bool): Si se calcula también el número total de ventas
+
+        Returns:
+            Pagina: Página de objetos Venta
+        """
+        clave = decodificar_cursor(cursor)
+        retroceder = retroceder and clave is not None
+
+        ventas = cls._consultar(
+            cliente_id=cliente_id,
+            desde=desde,
+            hasta=hasta,
+            limite=por_pagina + 1,
+            despues=None if retroceder else clave,
+            antes=clave if retroceder else None
+        )
+
+        pagina = Pagina.desde_consulta(ventas, por_pagina,
+                                       lambda venta: (venta.fecha.isoformat(sep=' '), venta.id),
+                                       clave, retroceder)
+        if con_total:
+            pagina.total = cls.contar(cliente_id=cliente_id, desde=desde, hasta=hasta)
+        return pagina
+
+    @staticmethod
+    def exportar(desde=None, hasta=None, cliente_id=None, proveedor_id=None):
+        """
+        Recorre las ventas con sus líneas para exportarlas (una fila por línea).
+
+        Args:
+            desde (str | datetime.date, optional): Primer día a incluir
+            hasta (str | datetime.date, optional): Último día a incluir
+            cliente_id (int, optional): Solo ventas de este cliente
+            proveedor_id (int, optional): Solo líneas de productos de este proveedor
+
+        Yields:
+            dict: Datos de la venta y de cada una de sus líneas
+        """
+        condiciones, params = [], []
+        _filtro_fechas("v.fecha", desde, hasta, condiciones, params)
+        if cliente_id:
+            condiciones.append("v.cliente_id = ?")
+            params.append(cliente_id)
+        if proveedor_id:
+            condiciones.append("p.proveedor_id = ?")
+            params.append(proveedor_id)
+
+        query = """
+        SELECT v.id as venta_id, v.fecha, v.cliente_id, u.username as cliente, v.total,
+               d.id as detalle_id, d.producto_id, p.referencia, p.nombre as producto,
+               d.cantidad, d.precio_unitario, d.coste_unitario
+        FROM ventas v
+        LEFT JOIN usuarios u ON u.id = v.cliente_id
+        LEFT JOIN ventas_detalle d ON d.venta_id = v.id
+        LEFT JOIN productos p ON p.id = d.producto_id
+        """
+        if condiciones:
+            query += " WHERE " + " AND ".join(condiciones)
+        query += " ORDER BY v.fecha, v.id, d.id"
+
+        return recorrer_consulta(query, params)
 
     def save(self):
         """
@@ -869,13 +1730,16 @@ class Venta:
             cursor = conn.cursor()
             
             if self.id:
-                # Actualizar venta existente
+                # Actualizar venta existente, descontándola antes de los resúmenes
+                self._actualizar_resumen_diario(cursor, self.id, -1)
+                VentaDetalle._actualizar_resumenes(cursor, -1, venta_id=self.id)
                 cursor.execute("""
                 UPDATE ventas SET
                     cliente_id = ?,
                     total = ?
                 WHERE id = ?
                 """, (self.cliente_id, self.total, self.id))
+                VentaDetalle._actualizar_resumenes(cursor, 1, venta_id=self.id)
             else:
                 # Crear nueva venta
                 cursor.execute("""
@@ -883,9 +1747,122 @@ class Venta:
                 VALUES (?, ?)
                 """, (self.cliente_id, self.total))
                 self.id = cursor.lastrowid
+
+            self._actualizar_resumen_diario(cursor, self.id, 1)
                 
             return self.id
 
+    @staticmethod
+    def _actualizar_resumen_diario(cursor, venta_id, signo):
+        """
+        Suma o resta una venta en el resumen ``ventas_diarias``.
+
+        Args:
+            cursor (sqlite3.Cursor): Cursor de la transacción en curso
+            venta_id (int): ID de la venta
+            signo (int): 1 para sumar la venta, -1 para restarla
+        """
+        cursor.execute("""
+        INSERT INTO ventas_diarias (fecha, cliente_id, total, num_ventas)
+        SELECT date(fecha), cliente_id, ? * total, ?
+        FROM ventas
+        WHERE id = ?
+        ON CONFLICT (fecha, cliente_id) DO UPDATE SET
+            total = total + excluded.total,
+            num_ventas = num_ventas + excluded.num_ventas
+        """, (signo, signo, venta_id))
+
+    @classmethod
+    def crear_con_detalles(cls, cliente_id, lineas):
+        """
+        Registra una venta completa con todas sus líneas en una sola transacción.
+
+        El stock de todos los productos se consulta de una vez, las líneas se
+        insertan con ``executemany`` y el stock se descuenta de forma condicionada
+        (``stock_actual >= cantidad``). Si no hay stock suficiente, la cantidad de
+        la línea se ajusta al disponible y se omite si queda a cero.
+
+        Si no hay ya una transacción abierta, se abre con ``BEGIN IMMEDIATE`` antes
+        de leer el stock, de modo que dos compras simultáneas no pueden validar el
+        mismo stock; el descuento condicionado cubre el caso en que la transacción
+        ya estaba abierta.
+
+        Args:
+            cliente_id (int): ID del cliente
+            lineas (list): Tuplas (producto_id, cantidad, precio_unitario)
+
+        Returns:
+            tuple: (Venta creada, lista de diccionarios con las líneas ajustadas,
+                   con las claves producto_id, solicitada y servida)
+
+        Raises:
+            ValueError: Si ningún producto tiene stock disponible o el stock ha
+                cambiado mientras se registraba la venta
+        """
+        with get_db() as conn:
+            cursor = conn.cursor()
+
+            # Reservar el bloqueo de escritura antes de consultar el stock
+            if not conn.in_transaction:
+                conn.execute("BEGIN IMMEDIATE")
+
+            ids = sorted({producto_id for producto_id, _, _ in lineas})
+            cursor.execute("""
+            SELECT id, stock_actual FROM productos
+            WHERE id IN (SELECT value FROM json_each(?))
+            """, (json.dumps(ids),))
+            disponible = {row['id']: row['stock_actual'] for row in cursor.fetchall()}
+
+            detalles = []
+            recortadas = []
+            for producto_id, cantidad, precio in lineas:
+                servida = min(cantidad, max(disponible.get(producto_id, 0), 0))
+                if servida < cantidad:
+                    recortadas.append({
+                        'producto_id': producto_id,
+                        'solicitada': cantidad,
+                        'servida': servida
+                    })
+                if servida <= 0:
+                    continue
+                disponible[producto_id] -= servida
+                detalles.append((producto_id, servida, precio))
+
+            if not detalles:
+                raise ValueError("Ninguno de los productos tiene stock disponible")
+
+            venta = cls(
+                cliente_id=cliente_id,
+                total=sum(cantidad * precio for _, cantidad, precio in detalles)
+            )
+            venta.save()
+
+            cursor.executemany(f"""
+            INSERT INTO ventas_detalle (venta_id, producto_id, cantidad, precio_unitario,
+                                        coste_unitario, proveedor_id)
+            VALUES (?1, ?2, ?3, ?4, {sql_coste_venta('?2', '?1')},
+                    (SELECT proveedor_id FROM productos WHERE id = ?2))
+            """, [(venta.id, producto_id, cantidad, precio)
+                  for producto_id, cantidad, precio in detalles])
+
+            # Descontar el stock solo si sigue habiendo suficiente
+            cantidades = {}
+            for producto_id, cantidad, _ in detalles:
+                cantidades[producto_id] = cantidades.get(producto_id, 0) + cantidad
+            cursor.executemany("""
+            UPDATE productos
+            SET stock_actual = stock_actual - ?1
+            WHERE id = ?2 AND stock_actual >= ?1
+            """, [(cantidad, producto_id) for producto_id, cantidad in cantidades.items()])
+            if cursor.rowcount != len(cantidades):
+                raise ValueError("El stock de algún producto ha cambiado durante la compra; "
+                                 "inténtalo de nuevo")
+
+            VentaDetalle._actualizar_resumenes(cursor, 1, venta_id=venta.id)
+            Producto.invalidar_cache(solo_stock=True)
+
+            return venta, recortadas
+
     @classmethod
     def buscar(cls, texto):
         """Busca usuarios por nombre de usuario o email."""
@@ -936,55 +1913,65 @@ class VentaDetalle:
         producto_id (int): ID del producto
         cantidad (int): Cantidad de unidades
         precio_unitario (float): Precio unitario aplicado
+        coste_unitario (float): Coste del producto en el momento de la venta: el
+            precio de su última compra hasta esa fecha o, si no tiene compras, su
+            precio de compra de catálogo (véase ``db.sql_coste_venta``). Se guarda
+            al crear la línea junto con el proveedor del producto, que es al que se
+            atribuye el beneficio aunque el producto cambie después de proveedor
         producto (Producto): Objeto producto (relación)
     """
 
+    __slots__ = ('id', 'venta_id', 'producto_id', 'cantidad', 'precio_unitario',
+                 'coste_unitario', 'producto')
+
     def __init__(self, id=None, venta_id=None, producto_id=None, cantidad=0, 
-                 precio_unitario=0, producto=None):
+                 precio_unitario=0, producto=None, coste_unitario=None):
         """Inicializa una instancia de VentaDetalle."""
         self.id = id
         self.venta_id = venta_id
         self.producto_id = producto_id
         self.cantidad = cantidad
         self.precio_unitario = precio_unitario
+        self.coste_unitario = coste_unitario
         self.producto = producto
 
     @classmethod
-    def get_by_venta(cls, venta_id):
+    def get_by_venta(cls, venta_id, ligero=False):
         """
         Obtiene todos los detalles de una venta.
         
         Args:
             venta_id (int): ID de la venta
+            ligero (bool): Si se devuelven filas ligeras de solo lectura
             
         Returns:
-            list: Lista de objetos VentaDetalle
+            list: Lista de objetos VentaDetalle (o de filas ligeras)
         """
         with get_db() as conn:
             cursor = conn.cursor()
+            cursor.row_factory = None
             cursor.execute("""
             SELECT d.*, p.nombre as producto_nombre, p.referencia as producto_referencia
             FROM ventas_detalle d
             JOIN productos p ON d.producto_id = p.id
             WHERE d.venta_id = ?
             """, (venta_id,))
-            
+
+            if ligero:
+                return filas_ligeras(cursor)
+
+            columnas = columnas_cursor(cursor)
+            crear = mapeador(cls, columnas)
+            indice_nombre = columnas.index('producto_nombre')
+            indice_referencia = columnas.index('producto_referencia')
             detalles = []
-            for row in cursor.fetchall():
-                detalle = cls(
-                    id=row['id'],
-                    venta_id=row['venta_id'],
-                    producto_id=row['producto_id'],
-                    cantidad=row['cantidad'],
-                    precio_unitario=row['precio_unitario']
-                )
-                
+            for fila in cursor:
+                detalle = crear(fila)
                 detalle.producto = Producto(
-                    id=row['producto_id'],
-                    nombre=row['producto_nombre'],
-                    referencia=row['producto_referencia']
+                    id=detalle.producto_id,
+                    nombre=fila[indice_nombre],
+                    referencia=fila[indice_referencia]
                 )
-                
                 detalles.append(detalle)
                 
             return detalles
@@ -1000,7 +1987,8 @@ class VentaDetalle:
             cursor = conn.cursor()
             
             if self.id:
-                # Actualizar detalle existente
+                # Actualizar detalle existente, descontándolo antes del resumen
+                self._actualizar_resumenes(cursor, -1, detalle_id=self.id)
                 cursor.execute("""
                 UPDATE ventas_detalle SET
                     venta_id = ?,
@@ -1011,12 +1999,15 @@ class VentaDetalle:
                 """, (self.venta_id, self.producto_id, self.cantidad, 
                       self.precio_unitario, self.id))
             else:
-                # Crear nuevo detalle
-                cursor.execute("""
-                INSERT INTO ventas_detalle (venta_id, producto_id, cantidad, precio_unitario)
-                VALUES (?, ?, ?, ?)
+                # Crear nuevo detalle guardando el coste y el proveedor actuales del producto
+                cursor.execute(f"""
+                INSERT INTO ventas_detalle (venta_id, producto_id, cantidad, precio_unitario,
+                                            coste_unitario, proveedor_id)
+                VALUES (?1, ?2, ?3, ?4, {sql_coste_venta('?2', '?1')},
+                        (SELECT proveedor_id FROM productos WHERE id = ?2))
+                RETURNING id, coste_unitario
                 """, (self.venta_id, self.producto_id, self.cantidad, self.precio_unitario))
-                self.id = cursor.lastrowid
+                self.id, self.coste_unitario = cursor.fetchone()
                 
                 # Actualizar stock del producto
                 cursor.execute("""
@@ -1024,9 +2015,52 @@ class VentaDetalle:
                 SET stock_actual = stock_actual - ?
                 WHERE id = ?
                 """, (self.cantidad, self.producto_id))
+                Producto.invalidar_cache(solo_stock=True)
+
+            self._actualizar_resumenes(cursor, 1, detalle_id=self.id)
                 
             return self.id
 
+    @staticmethod
+    def _actualizar_resumenes(cursor, signo, detalle_id=None, venta_id=None):
+        """
+        Suma o resta líneas de venta en los resúmenes ``ventas_productos_diarias``
+        y ``beneficios_proveedor_diarios``.
+
+        Args:
+            cursor (sqlite3.Cursor): Cursor de la transacción en curso
+            signo (int): 1 para sumar las líneas, -1 para restarlas
+            detalle_id (int, optional): ID de una línea concreta
+            venta_id (int, optional): ID de la venta cuyas líneas se actualizan
+        """
+        if detalle_id is not None:
+            condicion, valor = "d.id = ?", detalle_id
+        else:
+            condicion, valor = "d.venta_id = ?", venta_id
+
+        cursor.execute(f"""
+        INSERT INTO ventas_productos_diarias (fecha, cliente_id, producto_id, cantidad)
+        SELECT date(v.fecha), v.cliente_id, d.producto_id, ? * SUM(d.cantidad)
+        FROM ventas_detalle d
+        JOIN ventas v ON v.id = d.venta_id
+        WHERE {condicion}
+        GROUP BY d.producto_id
+        ON CONFLICT (fecha, cliente_id, producto_id) DO UPDATE SET
+            cantidad = cantidad + excluded.cantidad
+        """, (signo, valor))
+
+        cursor.execute(f"""
+        INSERT INTO beneficios_proveedor_diarios (fecha, proveedor_id, beneficio)
+        SELECT date(v.fecha), d.proveedor_id,
+               ? * SUM((d.precio_unitario - d.coste_unitario) * d.cantidad)
+        FROM ventas_detalle d
+        JOIN ventas v ON v.id = d.venta_id
+        WHERE {condicion} AND d.proveedor_id IS NOT NULL
+        GROUP BY d.proveedor_id
+        ON CONFLICT (fecha, proveedor_id) DO UPDATE SET
+            beneficio = beneficio + excluded.beneficio
+        """, (signo, valor))
+
     @classmethod
     def buscar(cls, texto):
         """Busca usuarios por nombre de usuario o email."""
@@ -1070,6 +2104,11 @@ class Compra:
         proveedor (Proveedor): Objeto proveedor (relación)
     """
 
+    __slots__ = ('id', 'proveedor_id', 'fecha', 'total', 'proveedor')
+
+    # Conversiones de columnas al construir objetos desde filas (véase ``mapeador``)
+    _CONVERSIONES = {'fecha': datetime.datetime.fromisoformat}
+
     def __init__(self, id=None, proveedor_id=None, fecha=None, total=0, proveedor=None):
         """Inicializa una instancia de Compra."""
         self.id = id
@@ -1119,20 +2158,25 @@ class Compra:
             return None
 
     @classmethod
-    def get_all(cls, proveedor_id=None, desde=None, hasta=None):
+    def get_all(cls, proveedor_id=None, desde=None, hasta=None, ligero=False):
         """
         Obtiene todas las compras con filtros opcionales.
+
+        Las compras a un mismo proveedor comparten el objeto ``proveedor``.
         
         Args:
             proveedor_id (int, optional): ID del proveedor para filtrar
             desde (datetime, optional): Fecha de inicio para filtrar
             hasta (datetime, optional): Fecha de fin para filtrar
+            ligero (bool): Si se devuelven filas ligeras de solo lectura (con
+                ``fecha`` como texto y ``proveedor_nombre``)
             
         Returns:
-            list: Lista de objetos Compra
+            list: Lista de objetos Compra (o de filas ligeras)
         """
         with get_db() as conn:
             cursor = conn.cursor()
+            cursor.row_factory = None
             
             query = """
             SELECT c.*, p.nombre as proveedor_nombre
@@ -1161,25 +2205,61 @@ class Compra:
             query += " ORDER BY c.fecha DESC"
             
             cursor.execute(query, params)
-            
+
+            if ligero:
+                return filas_ligeras(cursor)
+
+            columnas = columnas_cursor(cursor)
+            crear = mapeador(cls, columnas)
+            indice_proveedor = columnas.index('proveedor_nombre')
+            proveedores = {}
             compras = []
-            for row in cursor.fetchall():
-                compra = cls(
-                    id=row['id'],
-                    proveedor_id=row['proveedor_id'],
-                    fecha=datetime.datetime.fromisoformat(row['fecha']),
-                    total=row['total']
-                )
-                
-                compra.proveedor = Proveedor(
-                    id=row['proveedor_id'],
-                    nombre=row['proveedor_nombre']
-                )
-                
+            for fila in cursor:
+                compra = crear(fila)
+                compra.proveedor = proveedores.get(compra.proveedor_id)
+                if compra.proveedor is None:
+                    compra.proveedor = proveedores[compra.proveedor_id] = Proveedor(
+                        id=compra.proveedor_id,
+                        nombre=fila[indice_proveedor]
+                    )
                 compras.append(compra)
                 
             return compras
 
+    @staticmethod
+    def exportar(desde=None, hasta=None, proveedor_id=None):
+        """
+        Recorre las compras con sus líneas para exportarlas (una fila por línea).
+
+        Args:
+            desde (str | datetime.date, optional): Primer día a incluir
+            hasta (str | datetime.date, optional): Último día a incluir
+            proveedor_id (int, optional): Solo compras a este proveedor
+
+        Yields:
+            dict: Datos de la compra y de cada una de sus líneas
+        """
+        condiciones, params = [], []
+        _filtro_fechas("c.fecha", desde, hasta, condiciones, params)
+        if proveedor_id:
+            condiciones.append("c.proveedor_id = ?")
+            params.append(proveedor_id)
+
+        query = """
+        SELECT c.id as compra_id, c.fecha, c.proveedor_id, prov.nombre as proveedor, c.total,
+               d.id as detalle_id, d.producto_id, p.referencia, p.nombre as producto,
+               d.cantidad, d.precio_unitario
+        FROM compras c
+        LEFT JOIN proveedores prov ON prov.id = c.proveedor_id
+        LEFT JOIN compras_detalle d ON d.compra_id = c.id
+        LEFT JOIN productos p ON p.id = d.producto_id
+        """
+        if condiciones:
+            query += " WHERE " + " AND ".join(condiciones)
+        query += " ORDER BY c.fecha, c.id, d.id"
+
+        return recorrer_consulta(query, params)
+
     def save(self):
         """
         Guarda o actualiza la compra en la base de datos.
@@ -1208,6 +2288,70 @@ class Compra:
                 
             return self.id
 
+    @classmethod
+    def crear_con_detalles(cls, proveedor_id, lineas):
+        """
+        Registra la recepción de una compra con todas sus líneas en una sola transacción.
+
+        La existencia de los productos se comprueba con una sola consulta, las
+        líneas se insertan con ``executemany`` y el stock se incrementa con una
+        única sentencia agregada por producto. Las líneas de productos
+        inexistentes se omiten.
+
+        Args:
+            proveedor_id (int): ID del proveedor
+            lineas (list): Tuplas (producto_id, cantidad, precio_unitario)
+
+        Returns:
+            tuple: (Compra creada, lista de IDs de producto omitidos)
+
+        Raises:
+            ValueError: Si ninguno de los productos existe
+        """
+        with get_db() as conn:
+            cursor = conn.cursor()
+
+            ids = sorted({producto_id for producto_id, _, _ in lineas})
+            cursor.execute("""
+            SELECT id FROM productos
+            WHERE id IN (SELECT value FROM json_each(?))
+            """, (json.dumps(ids),))
+            existentes = {row['id'] for row in cursor.fetchall()}
+
+            detalles = [linea for linea in lineas if linea[0] in existentes]
+            omitidos = [producto_id for producto_id in ids if producto_id not in existentes]
+
+            if not detalles:
+                raise ValueError("Ninguno de los productos existe")
+
+            compra = cls(
+                proveedor_id=proveedor_id,
+                total=sum(cantidad * precio for _, cantidad, precio in detalles)
+            )
+            compra.save()
+
+            cursor.executemany("""
+            INSERT INTO compras_detalle (compra_id, producto_id, cantidad, precio_unitario)
+            VALUES (?, ?, ?, ?)
+            """, [(compra.id, producto_id, cantidad, precio)
+                  for producto_id, cantidad, precio in detalles])
+
+            # Incrementar el stock de todas las líneas con una sola sentencia
+            cursor.execute("""
+            UPDATE productos
+            SET stock_actual = stock_actual + d.cantidad
+            FROM (
+                SELECT producto_id, SUM(cantidad) AS cantidad
+                FROM compras_detalle
+                WHERE compra_id = ?
+                GROUP BY producto_id
+            ) AS d
+            WHERE productos.id = d.producto_id
+            """, (compra.id,))
+            Producto.invalidar_cache(solo_stock=True)
+
+            return compra, omitidos
+
     @classmethod
     def buscar(cls, texto):
         """Busca usuarios por nombre de usuario o email."""
@@ -1261,6 +2405,8 @@ class CompraDetalle:
         producto (Producto): Objeto producto (relación)
     """
 
+    __slots__ = ('id', 'compra_id', 'producto_id', 'cantidad', 'precio_unitario', 'producto')
+
     def __init__(self, id=None, compra_id=None, producto_id=None, cantidad=0, 
                  precio_unitario=0, producto=None):
         """Inicializa una instancia de CompraDetalle."""
@@ -1272,41 +2418,42 @@ class CompraDetalle:
         self.producto = producto
 
     @classmethod
-    def get_by_compra(cls, compra_id):
+    def get_by_compra(cls, compra_id, ligero=False):
         """
         Obtiene todos los detalles de una compra.
         
         Args:
             compra_id (int): ID de la compra
+            ligero (bool): Si se devuelven filas ligeras de solo lectura
             
         Returns:
-            list: Lista de objetos CompraDetalle
+            list: Lista de objetos CompraDetalle (o de filas ligeras)
         """
         with get_db() as conn:
             cursor = conn.cursor()
+            cursor.row_factory = None
             cursor.execute("""
             SELECT d.*, p.nombre as producto_nombre, p.referencia as producto_referencia
             FROM compras_detalle d
             JOIN productos p ON d.producto_id = p.id
             WHERE d.compra_id = ?
             """, (compra_id,))
-            
+
+            if ligero:
+                return filas_ligeras(cursor)
+
+            columnas = columnas_cursor(cursor)
+            crear = mapeador(cls, columnas)
+            indice_nombre = columnas.index('producto_nombre')
+            indice_referencia = columnas.index('producto_referencia')
             detalles = []
-            for row in cursor.fetchall():
-                detalle = cls(
-                    id=row['id'],
-                    compra_id=row['compra_id'],
-                    producto_id=row['producto_id'],
-                    cantidad=row['cantidad'],
-                    precio_unitario=row['precio_unitario']
-                )
-                
+            for fila in cursor:
+                detalle = crear(fila)
                 detalle.producto = Producto(
-                    id=row['producto_id'],
-                    nombre=row['producto_nombre'],
-                    referencia=row['producto_referencia']
+                    id=detalle.producto_id,
+                    nombre=fila[indice_nombre],
+                    referencia=fila[indice_referencia]
                 )
-                
                 detalles.append(detalle)
                 
             return detalles
@@ -1346,6 +2493,7 @@ class CompraDetalle:
                 SET stock_actual = stock_actual + ?
                 WHERE id = ?
                 """, (self.cantidad, self.producto_id))
+                Producto.invalidar_cache(solo_stock=True)
                 
             return self.id
 
@@ -1389,6 +2537,9 @@ class Estadisticas:
     def ventas_mensuales(dias=30, cliente_id=None):
         """
         Obtiene las ventas mensuales agrupadas por mes.
+
+        Se calcula sobre el resumen diario ``ventas_diarias``, por lo que el coste
+        depende del número de días y no del número de ventas.
         
         Args:
             dias (int): Número de días a considerar
@@ -1402,10 +2553,10 @@ class Estadisticas:
             
             query = """
             SELECT 
-                strftime('%Y-%m', fecha) as mes,
+                substr(fecha, 1, 7) as mes,
                 SUM(total) as total
-            FROM ventas
-            WHERE fecha >= datetime('now', ?)
+            FROM ventas_diarias
+            WHERE fecha >= date('now', ?)
             """
             
             params = [f'-{dias} days']
@@ -1414,7 +2565,7 @@ class Estadisticas:
                 query += " AND cliente_id = ?"
                 params.append(cliente_id)
                 
-            query += " GROUP BY mes ORDER BY mes"
+            query += " GROUP BY mes HAVING SUM(num_ventas) > 0 ORDER BY mes"
             
             cursor.execute(query, params)
             
@@ -1424,6 +2575,10 @@ class Estadisticas:
     def productos_mas_vendidos(dias=30, cliente_id=None, limit=10):
         """
         Obtiene los productos más vendidos.
+
+        Se calcula sobre el resumen ``ventas_productos_diarias``. En ventanas
+        largas los totales por producto se recorren una sola vez quedándose con
+        los ``limit`` mayores, sin ordenar el resto.
         
         Args:
             dias (int): Número de días a considerar
@@ -1438,36 +2593,47 @@ class Estadisticas:
             
             query = """
             SELECT 
-                p.nombre as producto,
-                SUM(vd.cantidad) as cantidad
-            FROM ventas_detalle vd
-            JOIN ventas v ON vd.venta_id = v.id
-            JOIN productos p ON vd.producto_id = p.id
-            WHERE v.fecha >= datetime('now', ?)
+                r.producto_id,
+                SUM(r.cantidad) as cantidad
+            FROM ventas_productos_diarias r
+            WHERE r.fecha >= date('now', ?)
             """
             
             params = [f'-{dias} days']
             
             if cliente_id:
-                query += " AND v.cliente_id = ?"
+                query += " AND r.cliente_id = ?"
                 params.append(cliente_id)
                 
-            query += """
-            GROUP BY vd.producto_id
-            ORDER BY cantidad DESC
-            LIMIT ?
-            """
-            params.append(limit)
-            
-            cursor.execute(query, params)
+            query += " GROUP BY r.producto_id HAVING SUM(r.cantidad) > 0"
+
+            if dias > DIAS_RANKING_MONTICULO:
+                cursor.execute(query, params)
+                ranking = [(row['producto_id'], row['cantidad'])
+                           for row in heapq.nlargest(limit, cursor, key=lambda row: row['cantidad'])]
+            else:
+                cursor.execute(query + " ORDER BY cantidad DESC LIMIT ?", params + [limit])
+                ranking = [(row['producto_id'], row['cantidad']) for row in cursor.fetchall()]
+
+            # Obtener los nombres solo de los productos del ranking
+            cursor.execute("""
+            SELECT id, nombre FROM productos
+            WHERE id IN (SELECT value FROM json_each(?))
+            """, (json.dumps([producto_id for producto_id, _ in ranking]),))
+            nombres = {row['id']: row['nombre'] for row in cursor.fetchall()}
             
-            return [{'producto': row['producto'], 'cantidad': row['cantidad']} 
-                    for row in cursor.fetchall()]
+            return [{'producto': nombres.get(producto_id), 'cantidad': cantidad}
+                    for producto_id, cantidad in ranking if producto_id in nombres]
 
     @staticmethod
     def beneficios_por_proveedor(dias=30, limit=10):
         """
         Obtiene los beneficios generados por proveedor.
+
+        Se calcula sobre el resumen ``beneficios_proveedor_diarios``, que usa el
+        coste de cada producto y su proveedor en el momento de la venta. Para las
+        ventas anteriores a guardar el coste, sin compras previas del producto, el
+        coste es aproximado (véase ``db.sql_coste_venta``).
         
         Args:
             dias (int): Número de días a considerar
@@ -1482,13 +2648,11 @@ class Estadisticas:
             query = """
             SELECT 
                 prov.nombre as proveedor,
-                SUM((vd.precio_unitario - p.precio_compra) * vd.cantidad) as beneficio
-            FROM ventas_detalle vd
-            JOIN ventas v ON vd.venta_id = v.id
-            JOIN productos p ON vd.producto_id = p.id
-            JOIN proveedores prov ON p.proveedor_id = prov.id
-            WHERE v.fecha >= datetime('now', ?)
-            GROUP BY p.proveedor_id
+                SUM(r.beneficio) as beneficio
+            FROM beneficios_proveedor_diarios r
+            JOIN proveedores prov ON r.proveedor_id = prov.id
+            WHERE r.fecha >= date('now', ?)
+            GROUP BY r.proveedor_id
             ORDER BY beneficio DESC
             LIMIT ?
             """
@@ -1498,16 +2662,74 @@ class Estadisticas:
             return [{'proveedor': row['proveedor'], 'beneficio': row['beneficio']} 
                     for row in cursor.fetchall()]
 
+    @staticmethod
+    def clientes_activos():
+        """
+        Cuenta los clientes distintos que han realizado alguna compra.
+
+        Returns:
+            int: Número de clientes con al menos una venta
+        """
+        with get_db() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT COUNT(DISTINCT cliente_id)
+                FROM ventas
+                WHERE cliente_id IS NOT NULL
+            """)
+            return cursor.fetchone()[0]
+
+    # Último resultado de stock_critico() junto con la versión con la que se calculó
+    _cache_stock_critico = None
+
+    @staticmethod
+    def invalidar_stock_critico():
+        """Descarta el resultado de stock crítico guardado en memoria."""
+        Estadisticas._cache_stock_critico = None
+
+    @staticmethod
+    def _version_stock_critico(cursor):
+        """
+        Obtiene la versión actual del conjunto de productos con stock crítico.
+
+        Args:
+            cursor (sqlite3.Cursor): Cursor de la conexión en uso
+
+        Returns:
+            int: Versión actual (0 si nunca ha habido stock crítico)
+        """
+        cursor.execute("SELECT IFNULL(MAX(version), 0) FROM stock_critico_versiones")
+        return cursor.fetchone()[0]
+
+    @staticmethod
+    def version_stock_critico():
+        """
+        Obtiene la versión actual del conjunto de productos con stock crítico.
+
+        Returns:
+            int: Versión actual
+        """
+        with get_db() as conn:
+            return Estadisticas._version_stock_critico(conn.cursor())
+
     @staticmethod
     def stock_critico():
         """
         Obtiene los productos con stock crítico.
+
+        El resultado se guarda en memoria y se reutiliza mientras no cambie la
+        versión del stock crítico ni se invalide desde una escritura.
         
         Returns:
             list: Lista de diccionarios con información de stock
         """
         with get_db() as conn:
             cursor = conn.cursor()
+
+            version = Estadisticas._version_stock_critico(cursor)
+            guardado = Estadisticas._cache_stock_critico
+            if guardado is not None and guardado[0] == version:
+                return [dict(fila) for fila in guardado[1]]
             
             query = """
             SELECT 
@@ -1521,5 +2743,116 @@ class Estadisticas:
             """
             
             cursor.execute(query)
+
+            datos = [dict(row) for row in cursor.fetchall()]
+            Estadisticas._cache_stock_critico = (version, datos)
             
-            return [dict(row) for row in cursor.fetchall()]
\ No newline at end of file
+            return [dict(fila) for fila in datos]
+
+    @staticmethod
+    def stock_critico_desde(version):
+        """
+        Obtiene los cambios en el stock crítico posteriores a una versión.
+
+        Permite a los paneles consultar solo lo que ha cambiado desde su última
+        lectura. Los productos que han salido del stock crítico (o se han
+        eliminado) aparecen con ``critico`` a False.
+
+        Args:
+            version (int): Última versión conocida por el cliente
+
+        Returns:
+            dict: Versión actual y lista de cambios
+        """
+        with get_db() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute("""
+            SELECT
+                sv.producto_id,
+                sv.version,
+                p.nombre as producto,
+                p.stock_actual as actual,
+                p.stock_minimo as minimo,
+                CASE WHEN p.stock_minimo > 0
+                     THEN CAST(p.stock_actual * 100.0 / p.stock_minimo as INT) END as porcentaje,
+                IFNULL(p.stock_actual <= p.stock_minimo AND p.stock_minimo > 0, 0) as critico
+            FROM stock_critico_versiones sv
+            LEFT JOIN productos p ON p.id = sv.producto_id
+            WHERE sv.version > ?
+            ORDER BY sv.version
+            """, (version,))
+
+            cambios = []
+            for row in cursor.fetchall():
+                cambio = dict(row)
+                cambio['critico'] = bool(cambio['critico'])
+                cambios.append(cambio)
+
+            return {
+                'version': cambios[-1]['version'] if cambios else max(version, 0),
+                'cambios': cambios
+            }
+
+    # Pool de hilos del panel de estadísticas (se crea la primera vez que se usa)
+    _ejecutor = None
+    _ejecutor_lock = threading.Lock()
+
+    @staticmethod
+    def _get_ejecutor():
+        """Obtiene el pool de hilos compartido para calcular el panel en paralelo."""
+        with Estadisticas._ejecutor_lock:
+            if Estadisticas._ejecutor is None:
+                Estadisticas._ejecutor = ThreadPoolExecutor(max_workers=ESTADISTICAS_HILOS,
+                                                            thread_name_prefix='estadisticas')
+            return Estadisticas._ejecutor
+
+    @staticmethod
+    def _calcular_en_hilo(funcion, args):
+        """Ejecuta una consulta del panel con la conexión de lectura del hilo."""
+        with conexion_lectura():
+            return funcion(*args)
+
+    @staticmethod
+    def dashboard(dias=30, paralelo=False):
+        """
+        Calcula todos los bloques del panel de estadísticas de administración.
+
+        Por defecto todas las consultas se ejecutan en una sola conexión y dentro
+        de una misma transacción de lectura, así que los bloques son coherentes
+        entre sí. Con ``paralelo`` cada consulta se lanza en un hilo del pool con
+        su propia conexión de solo lectura, que no sale del pool de conexiones de
+        las peticiones (véase ``db.conexion_lectura``): responde antes con bases de
+        datos grandes, a cambio de que cada bloque pueda ver un instante
+        ligeramente distinto.
+
+        Args:
+            dias (int): Número de días a considerar
+            paralelo (bool): Si las consultas se ejecutan en paralelo
+
+        Returns:
+            dict: Datos de cada bloque del panel
+        """
+        consultas = {
+            'ventas_mensuales': (Estadisticas.ventas_mensuales, (dias,)),
+            'productos_mas_vendidos': (Estadisticas.productos_mas_vendidos, (dias,)),
+            'beneficios_por_proveedor': (Estadisticas.beneficios_por_proveedor, (dias,)),
+            'clientes': (Estadisticas.clientes_activos, ()),
+            'stock_critico': (Estadisticas.stock_critico, ()),
+        }
+
+        if paralelo:
+            ejecutor = Estadisticas._get_ejecutor()
+            futuros = {nombre: ejecutor.submit(Estadisticas._calcular_en_hilo, funcion, args)
+                       for nombre, (funcion, args) in consultas.items()}
+            datos = {nombre: futuro.result() for nombre, futuro in futuros.items()}
+        else:
+            with get_db() as conn:
+                # Las consultas anidadas reutilizan esta conexión; BEGIN fija una
+                # única instantánea de lectura para todas ellas
+                if not conn.in_transaction:
+                    conn.execute("BEGIN")
+                datos = {nombre: funcion(*args) for nombre, (funcion, args) in consultas.items()}
+
+        datos['dias'] = dias
+        return datos
@@ -0,0 +1,261 @@
+"""
+Módulo para el cálculo y la verificación de hashes de contraseñas.
+
+PBKDF2 consume decenas de milisegundos de CPU por contraseña, así que los hashes
+se calculan en un pool de hilos propio y acotado: como mucho HASH_HILOS a la vez
+y HASH_MAX_PENDIENTES esperando. Si se supera ese límite la operación se rechaza
+con HashSaturado en lugar de acaparar el worker, de modo que una avalancha de
+inicios de sesión no bloquea el resto de peticiones.
+
+Los hashes guardan sus parámetros de coste (``pbkdf2_sha256$iteraciones$salt$clave``)
+para poder cambiar las iteraciones en cada despliegue; los hashes antiguos en
+formato ``salt:clave`` (100000 iteraciones) se siguen aceptando y se regeneran al
+iniciar sesión.
+
+"""
+
+import hashlib
+import hmac
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturoAgotado
+
+# Parámetros de coste de los hashes nuevos
+PBKDF2_ALGORITMO = 'sha256'
+PBKDF2_ITERACIONES = int(os.environ.get('STORE_PBKDF2_ITERACIONES', 100000))
+PBKDF2_LONGITUD_SALT = 32
+
+# Iteraciones de los hashes en el formato antiguo "salt:clave"
+PBKDF2_ITERACIONES_LEGADO = 100000
+
+# Límites del pool de hilos de hashing
+HASH_HILOS = int(os.environ.get('STORE_HASH_HILOS', 2))
+HASH_MAX_PENDIENTES = int(os.environ.get('STORE_HASH_MAX_PENDIENTES', 16))
+HASH_TIMEOUT = float(os.environ.get('STORE_HASH_TIMEOUT', 10))
+
+
+class HashSaturado(RuntimeError):
+    """El pool de hashing tiene demasiadas operaciones pendientes."""
+
+
+class EjecutorHash:
+    """
+    Pool de hilos acotado para calcular hashes de contraseñas.
+
+    Attributes:
+        hilos (int): Hashes que se calculan a la vez
+        max_pendientes (int): Operaciones que pueden esperar turno
+        timeout (float): Segundos máximos de espera por un resultado
+    """
+
+    def __init__(self, hilos=HASH_HILOS, max_pendientes=HASH_MAX_PENDIENTES, timeout=HASH_TIMEOUT):
+        """Inicializa el pool sin arrancar todavía ningún hilo."""
+        self.hilos = hilos
+        self.max_pendientes = max_pendientes
+        self.timeout = timeout
+        self._plazas = threading.BoundedSemaphore(hilos + max_pendientes)
+        self._ejecutor = None
+        self._lock = threading.Lock()
+        self._metricas = {
+            'completados': 0,
+            'rechazados': 0,
+            'en_curso': 0,
+            'max_en_curso': 0,
+            'tiempo_total': 0.0,
+            'tiempo_max': 0.0,
+            'espera_total': 0.0,
+        }
+
+    def _get_ejecutor(self):
+        """Crea el ThreadPoolExecutor la primera vez que se necesita."""
+        with self._lock:
+            if self._ejecutor is None:
+                self._ejecutor = ThreadPoolExecutor(max_workers=self.hilos,
+                                                    thread_name_prefix='hash')
+            return self._ejecutor
+
+    def _medir(self, funcion, args, encolado):
+        """Ejecuta la función en el hilo del pool registrando espera y duración."""
+        inicio = time.perf_counter()
+        try:
+            return funcion(*args)
+        finally:
+            fin = time.perf_counter()
+            with self._lock:
+                self._metricas['completados'] += 1
+                self._metricas['espera_total'] += inicio - encolado
+                self._metricas['tiempo_total'] += fin - inicio
+                self._metricas['tiempo_max'] = max(self._metricas['tiempo_max'], fin - inicio)
+
+    def ejecutar(self, funcion, *args):
+        """
+        Ejecuta una función en el pool y espera su resultado.
+
+        Args:
+            funcion (callable): Función a ejecutar
+            *args: Argumentos de la función
+
+        Returns:
+            object: Resultado de la función
+
+        Raises:
+            HashSaturado: Si ya hay demasiadas operaciones pendientes o no se
+                obtiene el resultado a tiempo
+        """
+        if not self._plazas.acquire(blocking=False):
+            with self._lock:
+                self._metricas['rechazados'] += 1
+            raise HashSaturado("Demasiadas operaciones de contraseña pendientes")
+
+        with self._lock:
+            self._metricas['en_curso'] += 1
+            self._metricas['max_en_curso'] = max(self._metricas['max_en_curso'],
+                                                 self._metricas['en_curso'])
+        try:
+            futuro = self._get_ejecutor().submit(self._medir, funcion, args, time.perf_counter())
+        except BaseException:
+            self._liberar()
+            raise
+        # La plaza se libera cuando termina el cálculo, aunque quien espera se haya rendido
+        futuro.add_done_callback(lambda _: self._liberar())
+
+        try:
+            return futuro.result(timeout=self.timeout)
+        except FuturoAgotado:
+            futuro.cancel()
+            with self._lock:
+                self._metricas['rechazados'] += 1
+            raise HashSaturado("Tiempo de espera agotado calculando la contraseña")
+
+    def _liberar(self):
+        """Devuelve una plaza del pool al terminar una operación."""
+        with self._lock:
+            self._metricas['en_curso'] -= 1
+        self._plazas.release()
+
+    def estadisticas(self):
+        """
+        Obtiene las métricas del pool.
+
+        Returns:
+            dict: Operaciones completadas y rechazadas, ocupación y tiempos medios (ms)
+        """
+        with self._lock:
+            m = dict(self._metricas)
+        completados = m['completados']
+        return {
+            'hilos': self.hilos,
+            'max_pendientes': self.max_pendientes,
+            'completados': completados,
+            'rechazados': m['rechazados'],
+            'en_curso': m['en_curso'],
+            'max_en_curso': m['max_en_curso'],
+            'tiempo_medio_ms': round(m['tiempo_total'] * 1000 / completados, 1) if completados else None,
+            'tiempo_max_ms': round(m['tiempo_max'] * 1000, 1),
+            'espera_media_ms': round(m['espera_total'] * 1000 / completados, 1) if completados else None,
+        }
+
+
+# Pool compartido por todo el proceso
+ejecutor_hash = EjecutorHash()
+
+
+def _derivar(password, salt, iteraciones, algoritmo=PBKDF2_ALGORITMO):
+    """Calcula la clave PBKDF2 de una contraseña."""
+    return hashlib.pbkdf2_hmac(algoritmo, password.encode('utf-8'), salt, iteraciones)
+
+
+def _parsear(stored_password):
+    """
+    Extrae los parámetros de un hash almacenado.
+
+    Args:
+        stored_password (str): Hash en formato nuevo o antiguo
+
+    Returns:
+        tuple: (algoritmo, iteraciones, salt, clave)
+
+    Raises:
+        ValueError: Si el hash no tiene un formato reconocido o sus parámetros
+            no son válidos
+    """
+    if '$' in stored_password:
+        esquema, iteraciones, salt_hex, key_hex = stored_password.split('$')
+        if not esquema.startswith('pbkdf2_'):
+            raise ValueError(f"Esquema de hash desconocido: {esquema}")
+        algoritmo = esquema[len('pbkdf2_'):]
+        if algoritmo not in hashlib.algorithms_available:
+            raise ValueError(f"Algoritmo de hash no disponible: {algoritmo}")
+        iteraciones = int(iteraciones)
+        if iteraciones <= 0:
+            raise ValueError("El número de iteraciones debe ser positivo")
+        return algoritmo, iteraciones, bytes.fromhex(salt_hex), bytes.fromhex(key_hex)
+
+    salt_hex, key_hex = stored_password.split(':')
+    return 'sha256', PBKDF2_ITERACIONES_LEGADO, bytes.fromhex(salt_hex), bytes.fromhex(key_hex)
+
+
+def hash_password(password, iteraciones=None):
+    """
+    Genera el hash de una contraseña en el pool de hashing.
+
+    Args:
+        password (str): Contraseña en texto plano
+        iteraciones (int, optional): Iteraciones de PBKDF2 (por defecto PBKDF2_ITERACIONES)
+
+    Returns:
+        str: Hash con sus parámetros de coste
+
+    Raises:
+        HashSaturado: Si el pool de hashing está saturado
+    """
+    iteraciones = iteraciones or PBKDF2_ITERACIONES
+    salt = os.urandom(PBKDF2_LONGITUD_SALT)
+    key = ejecutor_hash.ejecutar(_derivar, password, salt, iteraciones)
+    return f"pbkdf2_{PBKDF2_ALGORITMO}${iteraciones}${salt.hex()}${key.hex()}"
+
+
+def verify_password(stored_password, provided_password):
+    """
+    Verifica una contraseña contra su hash almacenado en el pool de hashing.
+
+    Args:
+        stored_password (str): Hash almacenado (formato nuevo o antiguo)
+        provided_password (str): Contraseña a verificar
+
+    Returns:
+        bool: True si la contraseña coincide, False en caso contrario
+
+    Raises:
+        HashSaturado: Si el pool de hashing está saturado
+    """
+    if not stored_password or provided_password is None:
+        return False
+    try:
+        algoritmo, iteraciones, salt, stored_key = _parsear(stored_password)
+        # PBKDF2 aún puede rechazar parámetros que pasan la validación (p. ej. un
+        # algoritmo disponible en hashlib pero no admitido por pbkdf2_hmac)
+        new_key = ejecutor_hash.ejecutar(_derivar, provided_password, salt, iteraciones, algoritmo)
+    except ValueError:
+        return False
+    return hmac.compare_digest(stored_key, new_key)
+
+
+def necesita_rehash(stored_password):
+    """
+    Indica si un hash debe regenerarse con los parámetros de coste actuales.
+
+    Args:
+        stored_password (str): Hash almacenado
+
+    Returns:
+        bool: True si usa el formato antiguo u otros parámetros de coste
+    """
+    try:
+        algoritmo, iteraciones, _, _ = _parsear(stored_password)
+    except ValueError:
+        return True
+    return ('$' not in stored_password
+            or algoritmo != PBKDF2_ALGORITMO
+            or iteraciones != PBKDF2_ITERACIONES)